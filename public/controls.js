@@ -112,6 +112,59 @@ function btnCalib() {
 	}
 }
 
+// The ID of the robot that commands are sent to. The server uses its first
+// robot when this is empty.
+var currentRobot = '';
+
+// Returns the URL for a request to the current robot.
+function robotURL(path) {
+	if (currentRobot) {
+		return path + '?robot=' + encodeURIComponent(currentRobot);
+	}
+	return path;
+}
+
+// Asks the server which robots it controls and lists them in the robot menu,
+// which is only shown when there is more than one.
+function listRobots() {
+	post('short:robots', function(text) {
+		var ids = text.split(' ');
+		var menu = document.getElementById('c-robot');
+		menu.innerHTML = '';
+		for (var i = 0; i < ids.length; i++) {
+			var option = document.createElement('option');
+			option.value = ids[i];
+			option.text = ids[i];
+			menu.appendChild(option);
+		}
+		menu.value = currentRobot || ids[0];
+		setVisible('c-robots', ids.length > 1);
+	}, function(sn) {
+		addToConsole("robot list failed (" + String(sn) + ")");
+	}, function() {
+		addToConsole("robot list timed out");
+	});
+}
+
+// Switches to controlling another robot. The status stream and the program
+// state come from the new robot from now on.
+function switchRobot(id) {
+	currentRobot = id;
+	// Long-polling picks up the new robot on its next request.
+	statusCursor = null;
+	lastSegment = null;
+	if (statusSource) {
+		statusSource.close();
+		listenStatus();
+	}
+	if (traceMode) {
+		toggleTrace();
+	}
+	clearConsole();
+	addToConsole("switched to robot " + id);
+	synchronize();
+}
+
 // Keep track of the state of program execution.
 var running = false;
 
@@ -167,53 +220,186 @@ function setParameter() {
 	send('set:' + name + '=' + val);
 }
 
-// Sends a message to the server and adds the response to the console.
-function send(message) {
-	post(message, function(text) {
-		addToConsole(text);
-		synchronize();
+// Sends messages to the server and adds the responses to the console. The
+// messages go in one batch along with a sync, so they only take one request.
+function send() {
+	sendCommands(Array.prototype.slice.call(arguments), null);
+}
+
+// Sends the commands like `send`, and then calls `onreply` with the data of the
+// first command's reply if it succeeded.
+function sendCommands(messages, onreply) {
+	postBatch(messages.concat(['short:sync']), function(replies) {
+		for (var i = 0; i < messages.length; i++) {
+			if (!replies[i].ok) {
+				addToConsole(replies[i].error);
+			} else if (replies[i].data !== null) {
+				addToConsole(replyText(replies[i].data));
+			}
+		}
+		var sync = replies[messages.length];
+		if (sync.ok) {
+			applySync(sync.data);
+		}
+		if (onreply && replies[0].ok) {
+			onreply(replies[0].data);
+		}
+	}, function(sn) {
+		addToConsole(messages.join(', ') + " failed (" + String(sn) + ")");
+	}, function() {
+		addToConsole(messages.join(', ') + " timed out");
+	});
+}
+
+// Adds a summary of the server's latency metrics to the console, with one
+// line for each kind of request, command, Myro call, and program loop.
+function showMetrics() {
+	postBatch(['short:metrics'], function(replies) {
+		var lines = [];
+		metricLines(replies[0].data, '', lines);
+		lines.sort().forEach(addToConsole);
 	}, function(sn) {
-		addToConsole(message + " failed (" + String(sn) + ")");
+		addToConsole("metrics failed (" + String(sn) + ")");
 	}, function() {
-		addToConsole(message + " timed out");
+		addToConsole("metrics timed out");
+	});
+}
+
+// Appends a line for each histogram summary in the tree of metrics to the
+// lines array. The labels leading to a summary are joined to make its name.
+function metricLines(tree, name, lines) {
+	if (tree.count !== undefined) {
+		lines.push(name + ": " + tree.count + "x, mean " + tree.mean_ms
+			+ " ms, p95 " + tree.p95_ms + " ms, max " + tree.max_ms + " ms");
+		return;
+	}
+	Object.keys(tree).forEach(function(key) {
+		var label = key.replace(/_seconds$/, '');
+		metricLines(tree[key], name ? name + ' ' + label : label, lines);
+	});
+}
+
+// Returns the text to show in the console for the data of a reply. Replies
+// with more data than a message (such as the points kept from a drawing) show
+// just the message.
+function replyText(data) {
+	if (typeof data == 'string') {
+		return data;
+	}
+	if (data.message !== undefined) {
+		return data.message;
+	}
+	return JSON.stringify(data);
+}
+
+// How long to wait before retrying a status request that failed (ms).
+var statusRetryDelay = 1000;
+
+// The stream of status messages and trace updates pushed by the server.
+var statusSource = null;
+
+// The last segment event received, which describes the robot's current motion.
+var lastSegment = null;
+
+// Begins receiving status messages from the server. Uses the event stream if
+// the browser supports it, and falls back to long-polling otherwise.
+function updateStatus() {
+	if (window.EventSource) {
+		listenStatus();
+	} else {
+		pollStatus();
+	}
+}
+
+// Opens the event stream. The browser reconnects automatically if it breaks.
+function listenStatus() {
+	statusSource = new EventSource(robotURL('/events'));
+	var source = statusSource;
+	statusSource.addEventListener('error', function() {
+		// The browser gives up if the server refuses the stream (because it
+		// has too many), so open a new one after a while.
+		if (source.readyState == EventSource.CLOSED && source == statusSource) {
+			setTimeout(listenStatus, statusRetryDelay);
+		}
+	});
+	statusSource.addEventListener('status', function(e) {
+		addToConsole(e.data);
+	});
+	statusSource.addEventListener('segment', function(e) {
+		lastSegment = JSON.parse(e.data);
+		lastSegment.received = getTime();
+		if (traceMode) {
+			applySegment(lastSegment);
+		}
 	});
 }
 
+// Sequence number of the last status message received by long-polling.
+var statusCursor = null;
+
 // Requests the latest status from the server, adds the response to the console,
 // and repeats immediately. There is no delay because the server uses
 // long-polling, so the connection will stay open until there is a new status.
-function updateStatus() {
-	post('long:status', function(text) {
-		addToConsole(text);
-		updateStatus();
-	}, updateStatus, updateStatus);
+// The server prefixes each status with its sequence number, which is passed
+// back so that no messages are lost between polls.
+function pollStatus() {
+	var command = 'long:status';
+	if (statusCursor !== null) {
+		command += ':' + statusCursor;
+	}
+	post(command, function(text) {
+		var i = text.indexOf(' ');
+		statusCursor = text.substring(0, i);
+		addToConsole(text.substring(i + 1));
+		pollStatus();
+	}, function() {
+		// The server refuses long-polls when it has too many, so back off.
+		setTimeout(pollStatus, statusRetryDelay);
+	}, pollStatus);
 }
 
 // Synchronizes the client state with the server.
 function synchronize() {
-	post('short:sync', function(text) {
-		var vals = text.split(' ');
-		var sProgram = vals[0];
-		var sRunning = (vals[1] == 'True');
-		var sCanReset = (vals[2] == 'True');
-		enableOtherPrograms(sProgram);
-		setStartStop(!sRunning);
-		setEnabled('btnc-reset', sCanReset);
-		setVisible('btnc-draw', sProgram == 'tracie');
-		currentProgram = sProgram;
-		running = sRunning;
-		if (traceMode && !running) {
-			toggleTrace();
-		}
-		if (nextSyncFn) {
-			nextSyncFn();
-			nextSyncFn = null;
-		}
+	postBatch(['short:sync'], function(replies) {
+		applySync(replies[0].data);
 	}, function(sn) {
 		addToConsole("sync failed (" + String(sn) + ")");
 	}, function() {
 		addToConsole("sync timed out");
-	})
+	});
+}
+
+// Updates the client state from the server's reply to a sync, which has the
+// program ID and whether it is running and can be reset.
+function applySync(state) {
+	enableOtherPrograms(state.program);
+	setStartStop(!state.running);
+	setEnabled('btnc-reset', state.can_reset);
+	setVisible('btnc-draw', state.program == 'tracie');
+	currentProgram = state.program;
+	running = state.running;
+	if (traceMode && !running) {
+		toggleTrace();
+	}
+	if (nextSyncFn) {
+		nextSyncFn();
+		nextSyncFn = null;
+	}
+}
+
+// Version of the structured protocol that batches are sent with.
+var protocolVersion = 1;
+
+// Sends several commands in one POST request using the structured protocol.
+// Each command is a plain-text command or an object with 'cmd', 'arg', and
+// 'format'. Calls the onreceive function with the list of replies, in the
+// same order, each of which has 'ok' and either 'data' or 'error'. The other
+// arguments are the same as for `post`.
+function postBatch(commands, onreceive, onfail, ontimeout) {
+	var data = JSON.stringify({v: protocolVersion, batch: commands});
+	post(data, function(text) {
+		onreceive(JSON.parse(text).replies);
+	}, onfail, ontimeout);
 }
 
 // Sends data to the server via a POST request. Calls the onreceive function
@@ -234,7 +420,7 @@ function post(data, onreceive, onfail, ontimeout) {
 			}
 		}
 	};
-	r.open('POST', '/', true);
+	r.open('POST', robotURL('/'), true);
 	r.setRequestHeader('Content-type', 'application/json');
 	r.timeout = ajaxTimeout;
 	r.ontimeout = ontimeout;
@@ -301,6 +487,7 @@ function generateParamHelp() {
 }
 
 window.onload = function() {
+	listRobots();
 	synchronize();
 	addToConsole("in sync with server");
 	// Sync every so often.
@@ -30,6 +30,25 @@ var arrowLineWidth = 2;
 
 var sendPointsWaitTime = 200;
 
+// Drawings with more points than this are streamed to the server in chunks, so
+// that the robot can start before all of them have arrived.
+var streamThreshold = 2000;
+var streamChunkSize = 500;
+var streamRetryTime = 500;
+
+// The format used to send points, agreed on with the server before the first
+// points are sent. The server lists the formats it accepts, most compact first.
+var pointFormat = null;
+var pointEncoders = {
+	'd16': encodeD16,
+	'f32': encodeF32,
+	'json': JSON.stringify
+};
+
+// Largest coordinate difference sent as one step in the d16 format. It is one
+// less than the largest 16-bit integer, to leave room for rounding.
+var maxD16 = 32766;
+
 // Sets up the canvas and context global variables.
 function setupCanvas() {
 	canvas = document.getElementById('canvas');
@@ -111,10 +130,169 @@ function convertPoints() {
 	});
 }
 
-// Sends the points to the server.
+// Sends the points to the server. The server simplifies them, and the robot's
+// progress is reported by indices into the points it kept, so those are the
+// points that are traced.
 function sendPoints() {
+	if (pointFormat === null) {
+		negotiatePointFormat(sendPoints);
+		return;
+	}
+	var ps = convertPoints();
+	if (ps.length > streamThreshold) {
+		tracePoints = [];
+		streamPoints(ps);
+		return;
+	}
 	tracePoints = deepCopy(points);
-	send('points:' + JSON.stringify(convertPoints()));
+	var fmt = formatFor(ps);
+	var prefix = (fmt == 'json') ? 'points:' : 'points-' + fmt + ':';
+	sendCommands([prefix + pointEncoders[fmt](ps)], function(data) {
+		if (data.kept) {
+			tracePoints = keptPoints(data.kept, ps[0]);
+		}
+	});
+}
+
+// Converts points kept by the server, which are relative to the first point
+// that was sent, back to canvas coordinates (see `convertPoints`).
+function keptPoints(kept, origin) {
+	return kept.map(function(k) {
+		return {x: k[0] + origin.x, y: canvas.style.height - (k[1] + origin.y)};
+	});
+}
+
+// Returns the format to send the points in. The first point in the d16 format
+// is relative to the origin and can't be split into steps, so f32 is used
+// instead when it is too far away.
+function formatFor(ps) {
+	if (pointFormat == 'd16' && ps.length > 0 && (
+			Math.abs(Math.round(ps[0].x)) > maxD16 ||
+			Math.abs(Math.round(ps[0].y)) > maxD16)) {
+		return 'f32';
+	}
+	return pointFormat;
+}
+
+// Sends the points to the server in numbered chunks, one at a time. When the
+// server's buffer is full, it replies 'wait' and the chunk is tried again later.
+// The points the server kept from each chunk are added to the traced points.
+function streamPoints(ps) {
+	var seq = 0;
+	var count = Math.ceil(ps.length / streamChunkSize);
+	var retry = function() {
+		setTimeout(next, streamRetryTime);
+	};
+	var next = function() {
+		if (seq >= count) {
+			send('stream:end');
+			return;
+		}
+		var chunk = ps.slice(seq * streamChunkSize, (seq+1) * streamChunkSize);
+		var fmt = formatFor(chunk);
+		var data = pointEncoders[fmt](chunk);
+		postBatch(['stream:' + seq + '-' + fmt + ':' + data], function(replies) {
+			if (!replies[0].ok) {
+				addToConsole(replies[0].error);
+				return;
+			}
+			var reply = replies[0].data;
+			if (reply.kept) {
+				tracePoints = tracePoints.concat(keptPoints(reply.kept, ps[0]));
+			}
+			var text = replyText(reply);
+			var vals = text.split(' ');
+			if (vals[0] == 'ack' || vals[0] == 'resend') {
+				seq = parseInt(vals[1]);
+				next();
+			} else if (vals[0] == 'wait') {
+				retry();
+			} else {
+				addToConsole(text);
+			}
+		}, function(sn) {
+			addToConsole("stream failed (" + String(sn) + ")");
+		}, retry);
+	};
+	post('stream:begin', function(text) {
+		addToConsole(text);
+		next();
+	}, function(sn) {
+		addToConsole("stream failed (" + String(sn) + ")");
+	}, function() {
+		addToConsole("stream timed out");
+	});
+}
+
+// Asks the server which point formats it accepts and chooses the first one that
+// can be encoded here, falling back to JSON. Calls `after` when done.
+function negotiatePointFormat(after) {
+	var choose = function(text) {
+		var formats = text ? text.split(' ') : [];
+		pointFormat = 'json';
+		for (var i = 0; i < formats.length; i++) {
+			if (pointEncoders[formats[i]]) {
+				pointFormat = formats[i];
+				break;
+			}
+		}
+		after();
+	};
+	post('short:point-formats', choose, function(sn) {
+		choose('');
+	}, function() {
+		choose('');
+	});
+}
+
+// Encodes the points as base64 little-endian 32-bit floats (x0, y0, x1, ...).
+function encodeF32(ps) {
+	var view = new DataView(new ArrayBuffer(ps.length * 8));
+	for (var i = 0; i < ps.length; i++) {
+		view.setFloat32(i*8, ps[i].x, true);
+		view.setFloat32(i*8 + 4, ps[i].y, true);
+	}
+	return toBase64(view.buffer);
+}
+
+// Encodes the points as base64 little-endian 16-bit integers, which are the
+// differences from each point to the next (the first is from the origin).
+// Moves that are too long for 16 bits are split into steps along the same line,
+// which the server merges again when it simplifies the path.
+function encodeD16(ps) {
+	var deltas = [];
+	var x = 0, y = 0;
+	for (var i = 0; i < ps.length; i++) {
+		var nx = Math.round(ps[i].x);
+		var ny = Math.round(ps[i].y);
+		var far = Math.max(Math.abs(nx - x), Math.abs(ny - y));
+		var steps = (i == 0) ? 1 : Math.max(1, Math.ceil(far / maxD16));
+		var px = x, py = y;
+		for (var k = 1; k <= steps; k++) {
+			var sx = x + Math.round((nx - x) * k / steps);
+			var sy = y + Math.round((ny - y) * k / steps);
+			deltas.push(sx - px, sy - py);
+			px = sx;
+			py = sy;
+		}
+		x = nx;
+		y = ny;
+	}
+	var view = new DataView(new ArrayBuffer(deltas.length * 2));
+	for (var j = 0; j < deltas.length; j++) {
+		view.setInt16(j*2, deltas[j], true);
+	}
+	return toBase64(view.buffer);
+}
+
+// Returns the base64 encoding of the bytes in the buffer.
+function toBase64(buffer) {
+	var bytes = new Uint8Array(buffer);
+	var chars = [];
+	for (var i = 0; i < bytes.length; i++) {
+		chars.push(String.fromCharCode(bytes[i]));
+	}
+	return btoa(chars.join(''));
 }
 
 // Adds an action to action array to keep track of user's input.
@@ -427,20 +605,46 @@ function drawTrace() {
 		};
 	} else if (traceInterpolate == 'rotate') {
 		theta = traceTheta + t * traceDeltaTheta;
+	} else if (traceInterpolate == 'arc') {
+		pos = arcPoint(pos, tracePoints[traceIndex+1], traceDeltaTheta, t);
+		theta = traceTheta + t * traceDeltaTheta;
 	}
 	drawDot(pos, 'blue');
 	drawArrow(pos, theta, 'blue');
 }
 
+// Returns the point at fraction t along the circular arc from p1 to p2 that
+// turns by deltaTheta radians. The canvas y-axis points down, so the arc bends
+// the other way from the chord than it does on the robot's side.
+function arcPoint(p1, p2, deltaTheta, t) {
+	var half = deltaTheta / 2;
+	var dx = p2.x - p1.x;
+	var dy = p2.y - p1.y;
+	var angle = Math.atan2(dy, dx) + (1 - t) * half;
+	var len = Math.sqrt(dx*dx + dy*dy) * Math.sin(t * half) / Math.sin(half);
+	return {
+		x: p1.x + len * Math.cos(angle),
+		y: p1.y + len * Math.sin(angle)
+	};
+}
+
+// Starts animating the robot's position. With the event stream, the last
+// segment event gives the current motion, so there is no need to ask for it.
 function traceStart() {
-	syncTrace(function() {
+	var animate = function() {
 		traceIntervalID = setInterval(function() {
 			updateTrace();
 			if (currentView == 'drawing') {
 				draw();
 			}
 		}, traceUpdateInterval);
-	});
+	};
+	if (statusSource && lastSegment) {
+		applySegment(lastSegment);
+		animate();
+	} else {
+		syncTrace(animate);
+	}
 }
 
 function traceStop() {
@@ -450,30 +654,58 @@ function traceStop() {
 }
 
 // Advances the simulation of the robot's position by updating the values of the
-// tracing variables.
+// tracing variables. When the server pushes segment events on the event stream,
+// polling is only needed if none has arrived yet.
 function updateTrace() {
 	var t = getTraceT();
-	if (traceInitial == 0 || (traceInterpolate && t > traceSyncTime)) {
+	if (traceInitial == 0
+		|| (!statusSource && traceInterpolate && t > traceSyncTime)) {
 		syncTrace();
 	}
 }
 
-function syncTrace(after) {
-	post('short:trace', function(text) {
-		var vals = text.split(' ');
-		if (vals.length == 2) {
-			traceIndex = parseInt(vals[0]);
-			traceTheta = parseFloat(vals[1]);
-			traceInterpolate = false;
+// Updates the tracing variables from a segment event pushed by the server, which
+// is sent whenever the robot begins (or resumes) a motion.
+function applySegment(seg) {
+	traceIndex = seg.index;
+	traceTheta = seg.heading;
+	traceInitial = seg.received - seg.elapsed * 1000;
+	if (seg.kind) {
+		tracePeriod = seg.duration * 1000;
+		traceDeltaTheta = seg.delta;
+		traceInterpolate = seg.kind;
+	} else {
+		traceInterpolate = false;
+	}
+}
+
+// Updates the tracing variables from the trace state string sent by the server.
+function applyTrace(text) {
+	var vals = text.split(' ');
+	if (vals.length == 2) {
+		traceIndex = parseInt(vals[0]);
+		traceTheta = parseFloat(vals[1]);
+		traceInterpolate = false;
+	} else {
+		traceInitial = getTime() - parseFloat(vals[0]) * 1000;
+		tracePeriod = parseFloat(vals[1]) * 1000;
+		traceIndex = parseInt(vals[2]);
+		var delta_i = parseInt(vals[3]);
+		traceTheta = parseFloat(vals[4]);
+		traceDeltaTheta = parseFloat(vals[5]);
+		if (delta_i == 0) {
+			traceInterpolate = 'rotate';
+		} else if (traceDeltaTheta == 0) {
+			traceInterpolate = 'drive';
 		} else {
-			traceInitial = getTime() - parseFloat(vals[0]) * 1000;
-			tracePeriod = parseFloat(vals[1]) * 1000;
-			traceIndex = parseInt(vals[2]);
-			var delta_i = parseInt(vals[3]);
-			traceTheta = parseFloat(vals[4]);
-			traceDeltaTheta = parseFloat(vals[5]);
-			traceInterpolate = (delta_i == 1) ? 'drive' : 'rotate';
+			traceInterpolate = 'arc';
 		}
+	}
+}
+
+function syncTrace(after) {
+	post('short:trace', function(text) {
+		applyTrace(text);
 		if (after) {
 			after();
 		}
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import sys
+from time import time
+
+from scribbler.simulation import load_scenarios, repeat, run_batch
+
+
+# Description for the usage message.
+DESC = "Runs scenarios against simulated robots faster than real time."
+
+# Configure the arguments.
+parser = argparse.ArgumentParser(description=DESC)
+parser.add_argument(
+    'scenarios',
+    type=str,
+    help="JSON file containing a list of scenarios"
+)
+parser.add_argument(
+    '-j',
+    '--jobs',
+    type=int,
+    default=None,
+    help="number of worker processes (one per CPU by default)"
+)
+parser.add_argument(
+    '-n',
+    '--repeat',
+    type=int,
+    default=1,
+    help="run each scenario this many times with different noise seeds"
+)
+parser.add_argument(
+    '-o',
+    '--output',
+    type=str,
+    help="write the results to this file instead of stdout"
+)
+
+# Parse the arguments.
+args = parser.parse_args()
+scenarios = repeat(load_scenarios(args.scenarios), args.repeat)
+
+# Run the scenarios, writing one JSON result per line as they finish.
+out = open(args.output, 'w') if args.output else sys.stdout
+began = time()
+results = []
+for result in run_batch(scenarios, args.jobs):
+    print(json.dumps(result, sort_keys=True), file=out)
+    out.flush()
+    results.append(result)
+wall = time() - began
+if args.output:
+    out.close()
+
+# Summarize the batch.
+ok = [r for r in results if not r.get('error')]
+completed = [r for r in ok if r['completed']]
+simulated = sum(r['time'] for r in ok)
+print("{} runs, {} failed, {} completed".format(
+    len(results), len(results) - len(ok), len(completed)), file=sys.stderr)
+if ok:
+    print("simulated {:.1f} s in {:.1f} s ({:.0f}x real time)".format(
+        simulated, wall, simulated / max(wall, 1e-6)), file=sys.stderr)
+    print("{} collisions, {:.1f} mode switches per run".format(
+        sum(r['collisions'] for r in ok),
+        sum(r['mode_switches'] for r in ok) / len(ok)), file=sys.stderr)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+from scribbler.benchmarks import BENCHMARKS, CLIENTS, POINT_SIZES, REQUESTS
+from scribbler.benchmarks import compare, run_benchmarks
+
+import template
+
+
+# Description for the usage message.
+DESC = "Measures the performance of the server and programs with simulated" \
+    " robots."
+
+# All web resources are in the public folder.
+PUBLIC = '../public'
+
+# Files that the benchmark server may serve (see `main.py`).
+WHITELIST = [
+    '/', '/index.html', '/404.html', '/style.css',
+    '/controls.js', '/drawing.js'
+]
+
+# Changes smaller than this fraction are not flagged when comparing results.
+THRESHOLD = 0.1
+
+# Configure the arguments.
+parser = argparse.ArgumentParser(description=DESC)
+parser.add_argument(
+    '-b',
+    '--bench',
+    choices=BENCHMARKS,
+    action='append',
+    help="run this benchmark (repeat this for several; all by default)"
+)
+parser.add_argument(
+    '-n',
+    '--requests',
+    type=int,
+    default=REQUESTS,
+    help="number of HTTP requests in each load test"
+)
+parser.add_argument(
+    '-c',
+    '--clients',
+    type=int,
+    default=CLIENTS,
+    help="number of HTTP clients making requests at once"
+)
+parser.add_argument(
+    '-s',
+    '--sizes',
+    type=str,
+    default=','.join(str(n) for n in POINT_SIZES),
+    help="numbers of points in the drawings, separated by commas"
+)
+parser.add_argument(
+    '-o',
+    '--output',
+    type=str,
+    help="write the results to this file instead of stdout"
+)
+parser.add_argument(
+    '--compare',
+    type=str,
+    metavar='FILE',
+    help="compare the results with earlier results from this file"
+)
+
+# Parse the arguments. The files are given relative to the current directory,
+# so resolve them before changing it.
+args = parser.parse_args()
+if args.output:
+    args.output = os.path.abspath(args.output)
+if args.compare:
+    args.compare = os.path.abspath(args.compare)
+
+# Go to this directory to make the relative paths work, and generate the HTML
+# for the server to serve.
+script_dir = os.path.dirname(sys.argv[0])
+if script_dir:
+    os.chdir(script_dir)
+options = {
+    'root': PUBLIC,
+    'whitelist': WHITELIST,
+    'requests': args.requests,
+    'clients': args.clients,
+    'sizes': [int(n) for n in args.sizes.split(',')]
+}
+template.generate()
+
+# Run the benchmarks and write the results as JSON.
+progress = lambda name: print("running " + name, file=sys.stderr)
+results = run_benchmarks(args.bench or BENCHMARKS, options, progress)
+out = open(args.output, 'w') if args.output else sys.stdout
+json.dump(results, out, indent=2, sort_keys=True)
+print(file=out)
+if args.output:
+    out.close()
+
+# Show how each number changed since the earlier results.
+if args.compare:
+    with open(args.compare) as f:
+        old = json.load(f)
+    for path, a, b, ratio in compare(old, results):
+        if ratio is None:
+            continue
+        flag = ' *' if abs(ratio - 1) > THRESHOLD else ''
+        print("{:<45} {:>12g} {:>12g} {:>7.2f}x{}".format(
+            path, a, b, ratio, flag), file=sys.stderr)
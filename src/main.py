@@ -7,9 +7,11 @@ from __future__ import print_function
 import argparse
 import os
 import sys
-import __builtin__
 
+from scribbler.robots import Registry, Robot, connect
+from scribbler.sensors import SAMPLE_PERIODS
 from scribbler.server import Server
+from scribbler.simulator import SimRobot, load_scene
 
 import template
 
@@ -20,6 +22,9 @@ DESC = "Starts the Scribbler Bot server."
 # All web resources are in the public folder.
 PUBLIC = '../public'
 
+# Serial port of the robot when none is given.
+DEFAULT_PORT = '/dev/tty.Fluke2-0530-Fluke2'
+
 # Requests for any paths other than these will 404.
 WHITELIST = [
     '/', '/index.html', '/404.html', '/style.css',
@@ -52,14 +57,29 @@ parser.add_argument(
     '-b',
     '--bluetooth',
     type=str,
-    default='/dev/tty.Fluke2-0530-Fluke2',
-    help="the Scribbler is on this Bluetooth serial port"
+    action='append',
+    metavar='[ID=]PORT',
+    help="a Scribbler is on this Bluetooth serial port (repeat this for"
+    " multiple robots, optionally giving each one an ID)"
 )
 parser.add_argument(
     '-d',
     '--dummymyro',
     action='store_true',
-    help="use a dummy Myro library"
+    help="use simulated robots instead of Myro"
+)
+parser.add_argument(
+    '-e',
+    '--scene',
+    type=str,
+    help="put the simulated robots in the scene from this JSON file"
+)
+parser.add_argument(
+    '-r',
+    '--samplerate',
+    type=float,
+    default=1.0 / SAMPLE_PERIODS['obstacle'],
+    help="sample the obstacle sensors this many times per second"
 )
 
 # Go to this directory to make the relative paths work.
@@ -78,19 +98,25 @@ if any([not os.path.exists(PUBLIC + p) for p in WHITELIST]):
     print("error: missing files in /public", file=sys.stderr)
     sys.exit(1)
 
-# Import Myro, or the dummy version.
+# Import Myro, unless the robots are simulated.
 if args.dummymyro:
-    import scribbler.programs.nomyro as myro
+    scene = load_scene(args.scene) if args.scene else None
 else:
     import myro
 
-# This is an ugly hack. I know.
-__builtin__.myro = myro
-
-# Start Myro
-myro.initialize(args.bluetooth)
+# Connect to each robot. Robots without an ID are numbered.
+registry = Registry()
+periods = {'obstacle': 1.0 / args.samplerate}
+for i, spec in enumerate(args.bluetooth or [DEFAULT_PORT]):
+    robot_id, _, port = spec.rpartition('=')
+    robot_id = robot_id or str(i + 1)
+    if args.dummymyro:
+        device = SimRobot(scene)
+    else:
+        device = connect(myro, port)
+    registry.add(Robot(robot_id, device, periods))
 
 # Start the server.
-server = Server(args.host, args.port, PUBLIC, WHITELIST)
+server = Server(args.host, args.port, PUBLIC, WHITELIST, registry)
 server.start(not args.nobrowser)
 server.stay_alive()
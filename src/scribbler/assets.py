@@ -0,0 +1,151 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Keeps the static resources of the web application in memory."""
+
+import hashlib
+import os.path
+import zlib
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from time import time
+
+
+# Minimum amount of time between checks for changes on disk (seconds).
+CHECK_INTERVAL = 1.0
+
+# Content coding used when the client does not ask for compression.
+IDENTITY = 'identity'
+
+# Content codings that assets are precompressed with, in order of preference.
+# Brotli is not in the standard library, so gzip is the only one for now.
+ENCODINGS = ['gzip']
+
+# Compression level for precompressed assets. This only runs when a file is
+# loaded, so it might as well be the maximum.
+COMPRESS_LEVEL = 9
+
+# Files smaller than this are not worth compressing (bytes).
+MIN_COMPRESS_SIZE = 256
+
+
+class Asset(object):
+
+    """A static file held in memory along with its cache validators."""
+
+    def __init__(self, path):
+        """Loads the file at the given path into memory."""
+        self.path = path
+        self.load()
+
+    def load(self):
+        """Reads the file and recomputes its validators."""
+        with open(self.path, 'rb') as f:
+            self.data = f.read()
+        self.mtime = os.path.getmtime(self.path)
+        digest = hashlib.md5(self.data).hexdigest()
+        self.etag = '"{}"'.format(digest)
+        self.variants = {IDENTITY: (self.data, self.etag)}
+        if len(self.data) >= MIN_COMPRESS_SIZE:
+            for coding in ENCODINGS:
+                compressed = compress(self.data, coding)
+                if len(compressed) < len(self.data):
+                    etag = '"{}-{}"'.format(digest, coding)
+                    self.variants[coding] = (compressed, etag)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.checked = time()
+
+    def refresh(self):
+        """Reloads the file if its modification time has changed, so that
+        regenerated templates show up without restarting the server. The disk
+        is checked at most once every `CHECK_INTERVAL` seconds."""
+        now = time()
+        if now - self.checked < CHECK_INTERVAL:
+            return
+        self.checked = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self.mtime:
+            self.load()
+
+    @property
+    def compressible(self):
+        """True if the asset has at least one compressed variant."""
+        return len(self.variants) > 1
+
+    def variant(self, env):
+        """Chooses the representation to send according to the Accept-Encoding
+        header of the request. Returns a triple `(coding, data, etag)`."""
+        coding = choose_encoding(env.get('HTTP_ACCEPT_ENCODING', ''),
+                                 self.variants)
+        data, etag = self.variants[coding]
+        return coding, data, etag
+
+    def is_fresh(self, env, etag):
+        """Returns true if the conditional headers of the request show that the
+        client's copy (of the variant with the given ETag) is still current,
+        and false otherwise."""
+        none_match = env.get('HTTP_IF_NONE_MATCH')
+        if none_match is not None:
+            tags = [tag.strip() for tag in none_match.split(',')]
+            return '*' in tags or etag in tags
+        modified_since = env.get('HTTP_IF_MODIFIED_SINCE')
+        if modified_since:
+            parsed = parsedate_tz(modified_since)
+            if parsed:
+                return int(self.mtime) <= mktime_tz(parsed)
+        return False
+
+
+class AssetCache(object):
+
+    """Preloads a set of static files and serves them from memory."""
+
+    def __init__(self, root, paths):
+        """Loads every path (relative to root) into the cache."""
+        self.assets = {}
+        for path in paths:
+            self.assets[path] = Asset(root + path)
+
+    def get(self, path):
+        """Returns the up-to-date asset for the path, or None if the path is not
+        in the cache."""
+        asset = self.assets.get(path)
+        if asset:
+            asset.refresh()
+        return asset
+
+
+def compress(data, coding):
+    """Compresses the data with the given content coding."""
+    if coding == 'gzip':
+        # A window size of 16 + 15 makes zlib write the gzip format.
+        c = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return c.compress(data) + c.flush()
+    raise ValueError("unknown content coding: " + coding)
+
+
+def choose_encoding(accept, available):
+    """Returns the preferred content coding out of `available` that is allowed
+    by the Accept-Encoding header value `accept`. Falls back to identity."""
+    qualities = {}
+    for item in accept.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding] = q
+    for coding in ENCODINGS:
+        if coding in available:
+            q = qualities.get(coding, qualities.get('*', 0.0))
+            if q > 0:
+                return coding
+    return IDENTITY
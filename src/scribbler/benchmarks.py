@@ -0,0 +1,420 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Measures the performance of the server, the programs, and the controller
+against simulated robots."""
+
+import base64
+import json
+import math
+import os
+import platform
+import random
+import struct
+from time import time
+
+import gevent
+from gevent import socket
+
+from scribbler.connections import MAX_LONG_POLLS
+from scribbler.metrics import PERCENTILES
+from scribbler.motion import MotionPlan
+from scribbler.planning import StrokePlanner
+from scribbler.protocol import Request
+from scribbler.robots import Registry, Robot
+from scribbler.server import Server
+from scribbler.simulation import SimulatedRobot
+from scribbler.simulator import SimRobot
+from scribbler.timing import monotonic
+
+
+# Version of the results format. Results with different versions can't be
+# compared.
+VERSION = 2
+
+# Names of the benchmarks, in the order they run.
+BENCHMARKS = ['static', 'sync', 'points', 'plan', 'loop', 'fanout']
+
+# Number of points in each size of drawing that is sent and planned.
+POINT_SIZES = [100, 1000, 10000, 100000]
+
+# Number of strokes in each size of drawing whose order is planned.
+STROKE_SIZES = [10, 100, 1000]
+
+# Number of HTTP requests made by each load test, and the number of clients
+# making them at once (each with one persistent connection).
+REQUESTS = 2000
+CLIENTS = 8
+
+# Number of times each timed operation is repeated. The fastest time is the
+# least disturbed by everything else, and the mean is reported as well.
+REPEATS = 3
+
+# Number of loop iterations timed for each program.
+LOOP_ITERATIONS = 2000
+
+# Numbers of clients waiting for a status message at once. Long-polls over HTTP
+# are limited to `MAX_LONG_POLLS`, so larger numbers wait on the controller.
+FANOUT_SIZES = [10, 100, 1000]
+
+# Number of status messages published to the waiting clients.
+FANOUT_ROUNDS = 20
+
+# Files requested in the static benchmark. They must be in the whitelist.
+STATIC_PATHS = ['/controls.js', '/style.css']
+
+# Seed for the random drawings, so that every run measures the same work.
+SEED = 0
+
+
+class HttpClient(object):
+
+    """A minimal HTTP/1.1 client with one persistent connection.
+
+    It uses gevent sockets, so many clients can run at once in the same
+    process as the server. Keeping the connection open means the benchmarks
+    measure requests rather than connection setup.
+    """
+
+    def __init__(self, address):
+        """Connects to the server at the `(host, port)` address."""
+        self.sock = socket.create_connection(address)
+        self.file = self.sock.makefile('rb')
+
+    def request(self, method, path, body=''):
+        """Makes a request and reads the whole response. Returns the status
+        code and the body."""
+        self.sock.sendall(
+            "{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}\r\n\r\n{}"
+            .format(method, path, len(body), body))
+        status = int(self.file.readline().split(' ', 2)[1])
+        length = 0
+        while True:
+            line = self.file.readline()
+            if line in ('\r\n', ''):
+                break
+            name, _, value = line.partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        return status, self.file.read(length)
+
+    def close(self):
+        """Closes the connection."""
+        self.file.close()
+        self.sock.close()
+
+
+def summarize(samples):
+    """Returns a dictionary with the number of samples and their mean,
+    percentiles, and maximum in milliseconds."""
+    ordered = sorted(samples)
+    n = len(ordered)
+    summary = {'n': n}
+    if not n:
+        return summary
+    summary['mean_ms'] = round(1000 * sum(ordered) / n, 4)
+    summary['max_ms'] = round(1000 * ordered[-1], 4)
+    for p in PERCENTILES:
+        i = min(n - 1, int(p / 100.0 * n))
+        summary['p{}_ms'.format(p)] = round(1000 * ordered[i], 4)
+    return summary
+
+
+def repeated(f, repeats=REPEATS):
+    """Calls `f` several times and returns a dictionary with the fastest and
+    the mean time in milliseconds."""
+    times = []
+    for _ in range(repeats):
+        start = monotonic()
+        f()
+        times.append(monotonic() - start)
+    return {
+        'best_ms': round(1000 * min(times), 4),
+        'mean_ms': round(1000 * sum(times) / len(times), 4)
+    }
+
+
+def random_walk(n, rng, step=8.0):
+    """Returns a drawing of n points as `(x, y)` pairs in pixels, made by a
+    walk that turns a little at each step. Few of its points can be removed by
+    simplification."""
+    x = y = 0.0
+    heading = 0.0
+    points = []
+    for _ in range(n):
+        heading += rng.uniform(-0.6, 0.6)
+        x += step * math.cos(heading)
+        y += step * math.sin(heading)
+        points.append((round(x), round(y)))
+    return points
+
+
+def random_strokes(n, rng, size=2000.0):
+    """Returns n short strokes scattered over a square drawing."""
+    strokes = []
+    for _ in range(n):
+        x, y = rng.uniform(0, size), rng.uniform(0, size)
+        strokes.append([(x + dx, y + dy) for dx, dy in random_walk(5, rng)])
+    return strokes
+
+
+def encode_points(points, fmt):
+    """Encodes a drawing in one of the point formats, as a client would."""
+    if fmt == 'json':
+        return json.dumps([{'x': x, 'y': y} for x, y in points])
+    if fmt == 'f32':
+        flat = [c for p in points for c in p]
+        return base64.b64encode(struct.pack('<{}f'.format(len(flat)), *flat))
+    deltas = []
+    last = (0, 0)
+    for p in points:
+        deltas += [int(p[0] - last[0]), int(p[1] - last[1])]
+        last = p
+    return base64.b64encode(struct.pack('<{}h'.format(len(deltas)), *deltas))
+
+
+def start_server(options):
+    """Starts a server on a free port, serving the whitelisted files in the
+    root directory given in the options and controlling one simulated robot
+    running Tracie. Returns the server and its address."""
+    registry = Registry()
+    registry.add(Robot('1', SimRobot()))
+    server = Server('127.0.0.1', 0, options['root'], options['whitelist'],
+                    registry)
+    # The access log would swamp the results, but it is still written.
+    server.httpd.log = open(os.devnull, 'w')
+    server.start(False, False)
+    return server, ('127.0.0.1', server.httpd.server_port)
+
+
+def load(address, requests, clients, method, paths, body=''):
+    """Makes the requests from the given number of clients at once, cycling
+    through the paths. Returns the latency summary, the throughput, and the
+    number of requests that failed."""
+    samples = []
+    errors = [0]
+
+    def client(count):
+        conn = HttpClient(address)
+        try:
+            for i in range(count):
+                path = paths[i % len(paths)]
+                start = monotonic()
+                status, _ = conn.request(method, path, body)
+                samples.append(monotonic() - start)
+                if status >= 400:
+                    errors[0] += 1
+        finally:
+            conn.close()
+
+    per_client = max(1, requests // clients)
+    began = monotonic()
+    gevent.joinall([gevent.spawn(client, per_client) for _ in range(clients)],
+                   raise_error=True)
+    wall = monotonic() - began
+    result = summarize(samples)
+    result['clients'] = clients
+    result['requests_per_s'] = round(len(samples) / wall, 1)
+    result['errors'] = errors[0]
+    return result
+
+
+def bench_static(options):
+    """Measures GETs of static files, which are served from memory."""
+    server, address = start_server(options)
+    try:
+        return load(address, options['requests'], options['clients'], 'GET',
+                    STATIC_PATHS)
+    finally:
+        server.stop()
+
+
+def bench_sync(options):
+    """Measures POSTs of 'short:sync', the command that clients send most."""
+    server, address = start_server(options)
+    try:
+        return load(address, options['requests'], options['clients'], 'POST',
+                    ['/'], 'short:sync')
+    finally:
+        server.stop()
+
+
+def bench_points(options):
+    """Measures how long Tracie takes to receive drawings of each size in each
+    point format, which includes decoding, simplifying, and planning them."""
+    rng = random.Random(SEED)
+    controller = SimulatedRobot('bench', None, 'tracie').controller
+    results = {}
+    for n in options['sizes']:
+        points = random_walk(n, rng)
+        by_format = results[str(n)] = {}
+        for fmt in ['json', 'f32', 'd16']:
+            request = Request('points', encode_points(points, fmt), fmt)
+            by_format[fmt] = repeated(lambda: controller.handle(request))
+        by_format['kept'] = len(controller.program.new_points)
+    return results
+
+
+def bench_plan(options):
+    """Measures Tracie's planning: compiling the motions for a path, compiling
+    them again after a parameter changes, and ordering strokes."""
+    rng = random.Random(SEED)
+    tracie = SimulatedRobot('bench', None, 'tracie').controller.program
+    results = {'motions': {}, 'strokes': {}}
+    for n in options['sizes']:
+        points = tracie.simplify_points(random_walk(n, rng))
+        plan = MotionPlan(points, tracie.params)
+        results['motions'][str(n)] = {
+            'plan': repeated(lambda: MotionPlan(points, tracie.params)),
+            'compile': repeated(plan.compile)
+        }
+    for n in STROKE_SIZES:
+        strokes = random_strokes(n, rng)
+        planner = StrokePlanner(strokes, tracie.drive_cost, tracie.rotate_cost)
+        results['strokes'][str(n)] = {
+            'nearest_neighbour': repeated(planner.nearest_neighbour),
+            'improve': repeated(
+                lambda: planner.improve(planner.nearest_neighbour()))
+        }
+    return results
+
+
+def bench_loop(options):
+    """Measures the time the controller spends on each iteration of its main
+    loop, for each program, and separately the time spent waiting after it.
+    The robots are simulated on a virtual clock, so waiting takes no time
+    except for polling the conditions that programs watch."""
+    rng = random.Random(SEED)
+    results = {}
+    for program_id, commands in [
+            ('tracie', ['points:' + encode_points(random_walk(5000, rng),
+                                                  'json')]),
+            ('avoid', [])]:
+        robot = SimulatedRobot('bench', None, program_id)
+        controller = robot.controller
+        for command in commands:
+            controller(command)
+        program = controller.program
+        program.start()
+        iterations = []
+        waits = []
+        for _ in range(LOOP_ITERATIONS):
+            start = monotonic()
+            controller.main_loop(step=lambda: True)
+            middle = monotonic()
+            # Bound the wait so that a program watching for something that
+            # never happens can't hang.
+            controller.wait(robot.clock.time() + 1)
+            iterations.append(middle - start)
+            waits.append(monotonic() - middle)
+        program.stop()
+        results[program_id] = {
+            'iteration': summarize(iterations),
+            'wait': summarize(waits)
+        }
+    return results
+
+
+def fanout(publish, wait, clients):
+    """Starts the clients waiting with `wait`, publishes a message, and
+    returns the time until every client has its reply."""
+    waiters = [gevent.spawn(wait) for _ in range(clients)]
+    gevent.sleep(0)
+    start = monotonic()
+    publish()
+    gevent.joinall(waiters, raise_error=True)
+    return monotonic() - start
+
+
+def bench_fanout(options):
+    """Measures how long it takes for a status message to reach every client
+    waiting for one: through HTTP long-polls, up to `MAX_LONG_POLLS` of them,
+    and through the controller for larger numbers of clients."""
+    results = {}
+    server, address = start_server(options)
+    controller = server.registry.get().controller
+    try:
+        conns = [HttpClient(address) for _ in range(MAX_LONG_POLLS)]
+        wait = lambda conn: conn.request('POST', '/', 'long:status:')
+        samples = []
+        for i in range(FANOUT_ROUNDS):
+            waiters = [gevent.spawn(wait, c) for c in conns]
+            # Give the requests time to arrive and start waiting.
+            gevent.sleep(0.05)
+            start = monotonic()
+            controller.publish('status', 'bench')
+            gevent.joinall(waiters, raise_error=True)
+            samples.append(monotonic() - start)
+        for conn in conns:
+            conn.close()
+        results['http-{}'.format(MAX_LONG_POLLS)] = summarize(samples)
+        for n in FANOUT_SIZES:
+            samples = [fanout(lambda: controller.publish('status', 'bench'),
+                              lambda: controller.poll_status(''), n)
+                       for _ in range(FANOUT_ROUNDS)]
+            results[str(n)] = summarize(samples)
+    finally:
+        server.stop()
+    return results
+
+
+# Functions that run each benchmark, given the options.
+FUNCTIONS = {
+    'static': bench_static,
+    'sync': bench_sync,
+    'points': bench_points,
+    'plan': bench_plan,
+    'loop': bench_loop,
+    'fanout': bench_fanout
+}
+
+
+def run_benchmarks(names, options, progress=None):
+    """Runs the named benchmarks with the options, which are a dictionary with
+    'root' and 'whitelist' (as for `Server`), 'requests', 'clients', and
+    'sizes'. Calls `progress` with each name before running it. Returns the
+    results."""
+    results = {}
+    for name in names:
+        if progress:
+            progress(name)
+        started = monotonic()
+        results[name] = FUNCTIONS[name](options)
+        results[name]['seconds'] = round(monotonic() - started, 3)
+    return {
+        'version': VERSION,
+        'time': int(time()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'options': dict((k, v) for k, v in options.items()
+                        if k not in ('root', 'whitelist')),
+        'results': results
+    }
+
+
+def flatten(tree, prefix=''):
+    """Returns a dictionary from the path of each number in the nested results
+    (such as 'static.p95_ms') to the number."""
+    flat = {}
+    for key, value in tree.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(old, new):
+    """Compares two sets of results. Returns a list of `(path, old, new,
+    ratio)` tuples for the numbers present in both, where the ratio is new over
+    old. For times a ratio above 1 is a slowdown, and for rates (such as
+    'requests_per_s') it is a speedup."""
+    if old.get('version') != new.get('version'):
+        raise ValueError("results have different versions")
+    before = flatten(old['results'])
+    after = flatten(new['results'])
+    rows = []
+    for path in sorted(set(before) & set(after)):
+        a, b = before[path], after[path]
+        rows.append((path, a, b, b / float(a) if a else None))
+    return rows
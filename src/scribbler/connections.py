@@ -0,0 +1,151 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Manages the server's HTTP connections and keeps statistics about them."""
+
+import socket
+from collections import deque
+from time import time
+
+from gevent import pywsgi
+
+
+# Number of connections handled at once. When they are all busy, new ones wait
+# to be accepted. This must be larger than `MAX_LONG_POLLS`, so that ordinary
+# requests can always get through.
+POOL_SIZE = 64
+
+# Number of requests that may be waiting for status messages at once, counting
+# both long-polls and event streams. Requests over the limit get a 503.
+MAX_LONG_POLLS = 16
+
+# An idle persistent connection is closed after this long (seconds). This must
+# be longer than the event stream's keep-alive interval.
+KEEPALIVE_TIMEOUT = 30
+
+# Maximum number of requests served on one persistent connection.
+KEEPALIVE_MAX = 1000
+
+# The request rate is measured over this long (seconds).
+RATE_WINDOW = 60
+
+
+class ConnectionStats(object):
+
+    """Counts connections and the requests made on them.
+
+    The point of persistent connections is that each one carries many
+    requests, so the report includes how many requests reused a connection
+    that was already open, and the request rate over the last minute.
+    """
+
+    def __init__(self):
+        """Creates statistics with nothing counted yet."""
+        self.opened = 0
+        self.active = 0
+        self.requests = 0
+        self.reused = 0
+        self.long_polls = 0
+        self.refused = 0
+        self.recent = deque()
+
+    def connection_opened(self):
+        """Records that a client connected."""
+        self.opened += 1
+        self.active += 1
+
+    def connection_closed(self):
+        """Records that a connection was closed."""
+        self.active -= 1
+
+    def request(self, first):
+        """Records a request, which is the first on its connection if `first`
+        is true."""
+        self.requests += 1
+        if not first:
+            self.reused += 1
+        now = time()
+        self.recent.append(now)
+        self.forget(now)
+
+    def forget(self, now):
+        """Forgets the requests that are too old to count towards the rate."""
+        while self.recent and self.recent[0] < now - RATE_WINDOW:
+            self.recent.popleft()
+
+    def start_long_poll(self):
+        """Records that a long-poll or event stream is starting, unless there
+        are already `MAX_LONG_POLLS` of them. Returns true if it may start."""
+        if self.long_polls >= MAX_LONG_POLLS:
+            self.refused += 1
+            return False
+        self.long_polls += 1
+        return True
+
+    def end_long_poll(self):
+        """Records that a long-poll or event stream has ended."""
+        self.long_polls -= 1
+
+    def report(self):
+        """Returns the statistics as a dictionary."""
+        self.forget(time())
+        return {
+            'connections': self.opened,
+            'active': self.active,
+            'requests': self.requests,
+            'reused': self.reused,
+            'per_connection': self.requests / float(max(1, self.opened)),
+            'rate': len(self.recent) / float(RATE_WINDOW),
+            'long_polls': self.long_polls,
+            'refused': self.refused
+        }
+
+
+class Handler(pywsgi.WSGIHandler):
+
+    """Handles the requests on one connection, with limits on how long it is
+    kept alive, and counts them in the server's `stats`."""
+
+    def __init__(self, sock, address, server, rfile=None):
+        """Creates a handler for the connection. An idle connection is closed
+        after `KEEPALIVE_TIMEOUT` seconds."""
+        # The base class wraps the socket in a file for reading requests, and
+        # the file keeps the timeout the socket had then, so it must be set
+        # first.
+        sock.settimeout(KEEPALIVE_TIMEOUT)
+        # The headers and the body of a response are sent separately. With
+        # Nagle's algorithm, the body would wait for the client to acknowledge
+        # the headers, which it delays by up to 40 ms on a reused connection.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        pywsgi.WSGIHandler.__init__(self, sock, address, server, rfile)
+
+    def handle(self):
+        """Handles requests until the connection is closed."""
+        stats = self.server.stats
+        stats.connection_opened()
+        self.count = 0
+        try:
+            pywsgi.WSGIHandler.handle(self)
+        finally:
+            stats.connection_closed()
+
+    def read_request(self, raw_requestline):
+        """Reads a request and counts it. The connection is closed after the
+        response if it has served `KEEPALIVE_MAX` requests."""
+        ok = pywsgi.WSGIHandler.read_request(self, raw_requestline)
+        self.server.stats.request(self.count == 0)
+        self.count += 1
+        if self.count >= KEEPALIVE_MAX:
+            self.close_connection = True
+        return ok
+
+    def finalize_headers(self):
+        """Tells the client whether the connection will stay open, and for how
+        long and how many more requests if it will."""
+        pywsgi.WSGIHandler.finalize_headers(self)
+        names = [h[0].lower() for h in self.response_headers]
+        if self.close_connection:
+            if 'connection' not in names:
+                self.response_headers.append(('Connection', 'close'))
+        else:
+            self.response_headers.append(('Keep-Alive', 'timeout={}, max={}'
+                .format(KEEPALIVE_TIMEOUT, KEEPALIVE_MAX - self.count)))
@@ -2,11 +2,15 @@
 
 """Mediates between the server and the currently executing program."""
 
-import json
+from time import time
 
-from gevent import Greenlet, sleep
-from gevent.queue import Empty, Queue
+from gevent import Greenlet
+from gevent.event import Event
 
+from scribbler.hub import Hub
+from scribbler.metrics import Timer, histogram_for
+from scribbler.profiler import CAPTURE_TIME, LoopProfiler
+from scribbler.protocol import parse, text_reply
 from scribbler.programs import avoider, calib, tracie
 
 
@@ -20,11 +24,9 @@ PROGRAMS = {
 # This is the program that is initially active.
 DEFAULT_PROGRAM = 'tracie'
 
-# The prefix to a command which indicates a program switch.
-PROGRAM_PREFIX = 'program:'
-
-# Amount of time to sleep between main loop iterations (seconds).
-LOOP_DELAY = 0.01
+# Amount of time to sleep between checks of a condition that the program is
+# waiting for, such as a sensor reading crossing a threshold (seconds).
+WATCH_DELAY = 0.01
 
 # Amount of time to delay before starting (seconds), to ensure that the starting
 # message gets sent before the program's first status update.
@@ -40,25 +42,47 @@ class Controller(object):
 
     """Manages a program's main loop in a Greenlet."""
 
-    def __init__(self, program_id=DEFAULT_PROGRAM):
-        """Creates a controller to control the specified program. The program
-        doesn't start executing until the start method is called."""
-        self.messages = Queue()
+    def __init__(self, robot, program_id=DEFAULT_PROGRAM):
+        """Creates a controller to control the specified program on the given
+        robot. The program doesn't start executing until the start method is
+        called."""
+        self.robot = robot
+        self.clock = robot.clock
+        self.hub = Hub()
+        self.wakeup = Event()
         self.program_id = program_id
-        self.program = PROGRAMS[program_id]()
+        self.program = PROGRAMS[program_id](robot)
         self.green = None
         self.can_reset = False
+        self.loop_stats = {}
+        self.command_stats = {}
+        self.profiler = LoopProfiler(self.clock, robot.id)
+        self.commands = {
+            'short:sync': self.sync,
+            'short:param-help': self.param_help,
+            'short:profile': self.short_profile,
+            'short:profile-dump': self.short_profile_dump,
+            'long:status': self.long_status,
+            'program': self.program_switch,
+            'control:start': self.control_start,
+            'control:stop': self.control_stop,
+            'control:reset': self.control_reset,
+            'control:profile': self.control_profile
+        }
 
     def start(self):
         """Starts (or resumes) the execution of the program."""
         self.green = Greenlet(self.main_loop)
         self.green.start_later(START_DELAY)
         self.program.start()
+        self.profiler.start()
+        self.publish_events()
         self.can_reset = True
 
     def stop(self):
         """Stops the execution of the program."""
         self.program.stop()
+        self.profiler.stop()
         if self.green:
             self.green.kill()
 
@@ -72,52 +96,192 @@ class Controller(object):
         """Stops execution and switches to a new program."""
         self.stop()
         self.program_id = program_id
-        self.program = PROGRAMS[program_id]()
+        self.program = PROGRAMS[program_id](self.robot)
         self.can_reset = False
 
-    def main_loop(self):
-        """Runs the program's loop method continously, collecting any returned
-        messages into the messages queue."""
+    def publish(self, event, data):
+        """Publishes an event to all clients through the hub."""
+        self.hub.publish(event, data)
+
+    def publish_events(self):
+        """Publishes the events that the program has queued."""
+        for event, data in self.program.take_events():
+            self.publish(event, data)
+
+    def main_loop(self, limit=None, step=None):
+        """Runs the program's loop method whenever the program asks for it,
+        publishing any returned messages and any events the program queued. The
+        time each iteration takes is recorded for each program, and the
+        profiler's warnings are published as statuses.
+
+        On the server it runs until it is killed. Simulations and benchmarks
+        give it a `limit` on the robot's clock: it returns true when the program
+        has nothing left to wait for, or false when the clock reaches the limit.
+        They can also give a `step` function, which is called after each
+        iteration and stops the loop (returning false) if it returns true.
+        """
         while True:
-            msg = self.program.loop()
+            histogram = histogram_for(self.loop_stats, self.program_id)
+            start = self.clock.time()
+            with Timer(histogram):
+                msg = self.program.loop()
+            self.profiler.iteration(start, self.clock.time())
             if msg:
-                self.messages.put(msg)
-            sleep(LOOP_DELAY)
+                self.publish('status', msg)
+            self.publish_events()
+            warning = self.profiler.take_warning()
+            if warning:
+                self.publish('status', warning)
+            if step is not None and step():
+                return False
+            if limit is not None:
+                if self.program.next_wake() == (None, None):
+                    return True
+                if self.clock.time() >= limit:
+                    return False
+            self.wait(limit)
 
-    def __call__(self, command):
-        """Accepts a command and either performs the desired action or passes
-        the message on to the program. Returns a status message."""
-        if command == 'short:sync':
-            pid = self.program_id
-            running = bool(self.green)
-            can_reset = self.can_reset
-            return "{} {} {}".format(pid, running, can_reset)
-        if command == 'short:param-help':
-            return json.dumps(self.program.codes)
-        if command == 'long:status':
-            try:
-                msg = self.messages.get(timeout=STATUS_POLL_TIMEOUT)
-            except Empty:
+    def wait(self, limit=None):
+        """Sleeps until the program's next scheduled wakeup: its deadline, the
+        condition it is watching, or a command arriving, whichever is first.
+        If `limit` is given, it stops waiting at that time on the robot's clock
+        regardless, which keeps a simulation from waiting forever. When it wakes
+        up for a deadline, the profiler records how late it was."""
+        delay, watch = self.program.next_wake()
+        end = None if delay is None else self.clock.time() + delay
+        if limit is not None:
+            end = limit if end is None else min(end, limit)
+        if watch is None:
+            delay = None if end is None else max(0, end - self.clock.time())
+            if not self.clock.wait(self.wakeup, delay) and end is not None:
+                self.profiler.wakeup(self.clock.time() - end)
+        else:
+            while not watch():
+                timeout = WATCH_DELAY
+                if end is not None:
+                    timeout = min(timeout, end - self.clock.time())
+                if timeout <= 0:
+                    self.profiler.wakeup(self.clock.time() - end)
+                    break
+                if self.clock.wait(self.wakeup, timeout):
+                    break
+        self.wakeup.clear()
+
+    def poll_status(self, cursor):
+        """Waits for the next status message after the cursor (the empty string
+        means the latest message) and returns it prefixed by its sequence
+        number, which the client passes back as the cursor for the next poll.
+        If messages after the cursor were lost, returns a notice instead.
+        Returns None if there is no new status before the timeout."""
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            cursor = self.hub.seq
+        if cursor > self.hub.seq:
+            cursor = 0
+        deadline = time() + STATUS_POLL_TIMEOUT
+        while True:
+            remaining = max(0, deadline - time())
+            missed, messages = self.hub.wait(cursor, remaining)
+            if missed:
+                return "{} missed {} messages".format(cursor + missed, missed)
+            for seq, event, data in messages:
+                if event == 'status':
+                    return "{} {}".format(seq, data)
+            if not messages:
                 return None
-            return msg
-        if command.startswith(PROGRAM_PREFIX):
-            prog = command[len(PROGRAM_PREFIX):]
-            self.switch_program(prog)
-            return "switched to {}".format(prog)
-        if command == 'control:start':
-            reason = self.program.no_start()
-            if reason:
-                return reason
-            if self.green:
-                return "already running"
-            self.start()
-            return "program resumed"
-        if command == 'control:stop':
-            if not self.green:
-                return "not running"
-            self.stop()
-            return "program paused"
-        if command == 'control:reset':
-            self.reset()
-            return "program reset"
-        return self.program(command)
+            # Skip over the messages that were not statuses.
+            cursor = messages[-1][0]
+
+    def handle(self, request):
+        """Performs the action for a Request, passing it on to the program if
+        it isn't one of the controller's commands. Returns the reply. The time
+        it takes is recorded by command name."""
+        name = request.name
+        handler = self.commands.get(name)
+        if handler is None and name not in self.program.commands:
+            name = 'unknown'
+        with Timer(histogram_for(self.command_stats, name)):
+            if handler is not None:
+                return handler(request)
+            msg = self.program.handle(request)
+        # The command may have changed what the program is waiting for.
+        self.wakeup.set()
+        return msg
+
+    def __call__(self, command):
+        """Accepts a plain-text command and either performs the desired action
+        or passes the message on to the program. Returns a status message."""
+        request = parse(command)
+        return text_reply(request.name, self.handle(request))
+
+    def sync(self, request):
+        """Returns the state that the client keeps in sync with."""
+        return {
+            'program': self.program_id,
+            'running': bool(self.green),
+            'can_reset': self.can_reset
+        }
+
+    def param_help(self, request):
+        """Returns the short codes of the program's parameters."""
+        return self.program.codes
+
+    def short_profile(self, request):
+        """Returns the profiler's measurements of the main loop."""
+        return self.profiler.report()
+
+    def short_profile_dump(self, request):
+        """Returns the summary of the last cProfile capture."""
+        return self.profiler.capture_summary or "no profile captured"
+
+    def long_status(self, request):
+        """Waits for the next status message after the cursor in the request
+        (see `poll_status`)."""
+        return self.poll_status(request.arg)
+
+    def program_switch(self, request):
+        """Switches to the program named in the request."""
+        prog = request.arg
+        if prog not in PROGRAMS:
+            return "unknown program: " + prog
+        self.switch_program(prog)
+        return "switched to {}".format(prog)
+
+    def control_start(self, request):
+        """Starts or resumes the program, unless it isn't ready."""
+        reason = self.program.no_start()
+        if reason:
+            return reason
+        if self.green:
+            return "already running"
+        self.start()
+        return "program resumed"
+
+    def control_stop(self, request):
+        """Pauses the program."""
+        if not self.green:
+            return "not running"
+        self.stop()
+        return "program paused"
+
+    def control_reset(self, request):
+        """Stops the program and resets it."""
+        self.reset()
+        return "program reset"
+
+    def control_profile(self, request):
+        """Runs cProfile for the number of seconds in the request (or
+        `CAPTURE_TIME`), which must be positive and finite. A status is published when
+        the capture is saved."""
+        try:
+            seconds = float(request.arg or CAPTURE_TIME)
+        except ValueError:
+            return "invalid duration: " + request.arg
+        # The comparison is false for NaN as well as for zero or less.
+        if not 0 < seconds < float('inf'):
+            return "invalid duration: " + request.arg
+        done = lambda path: self.publish('status', "profile saved to " + path)
+        if not self.profiler.start_capture(seconds, done):
+            return "already profiling"
+        return "profiling for {:g} s".format(seconds)
@@ -0,0 +1,65 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Simplifies polygonal paths before the robot draws them."""
+
+import math
+
+
+def point_line_dist(p, a, b):
+    """Returns the distance from point `p` to the line through `a` and `b`, or
+    to `a` itself if the two points coincide."""
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return math.hypot(p[0] - a[0], p[1] - a[1])
+    return abs(dx * (a[1] - p[1]) - dy * (a[0] - p[0])) / length
+
+
+def simplify(points, tolerance):
+    """Simplifies the path with the Ramer-Douglas-Peucker algorithm. Returns a
+    new list of points that keeps the endpoints and differs from the original
+    path by no more than `tolerance` anywhere."""
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return list(points)
+    keep = [False] * n
+    keep[0] = keep[n-1] = True
+    # Use an explicit stack, since paths can have thousands of points.
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        a = points[first]
+        b = points[last]
+        max_dist = 0
+        index = first
+        for i in range(first + 1, last):
+            d = point_line_dist(points[i], a, b)
+            if d > max_dist:
+                max_dist = d
+                index = i
+        if max_dist > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def merge_collinear(points):
+    """Removes repeated points and points in the middle of straight lines, so
+    that consecutive segments of the path always change direction. Returns a
+    new list of points."""
+    merged = []
+    for p in points:
+        if merged and p == merged[-1]:
+            continue
+        if len(merged) >= 2:
+            a, b = merged[-2], merged[-1]
+            ux, uy = b[0] - a[0], b[1] - a[1]
+            vx, vy = p[0] - b[0], p[1] - b[1]
+            # Same direction: no cross product and a positive dot product.
+            if ux * vy - uy * vx == 0 and ux * vx + uy * vy > 0:
+                merged[-1] = p
+                continue
+        merged.append(p)
+    return merged
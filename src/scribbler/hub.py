@@ -0,0 +1,64 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Fans out the messages published by the controller to all clients."""
+
+from collections import deque
+from itertools import islice
+
+from gevent.event import Event
+
+
+# Number of recent messages kept for clients that fall behind or reconnect.
+HISTORY_SIZE = 200
+
+
+class Hub(object):
+
+    """A publish/subscribe hub backed by a bounded ring buffer.
+
+    Every message gets a sequence number, starting at 1. Clients don't register
+    with the hub; each one keeps a cursor (the sequence number of the last
+    message it has seen) and asks for the messages after it. A client that
+    falls so far behind that its messages have left the buffer loses them, so
+    memory stays bounded no matter how slow the clients are.
+    """
+
+    def __init__(self, size=HISTORY_SIZE):
+        """Creates an empty hub that remembers `size` messages."""
+        self.history = deque(maxlen=size)
+        self.seq = 0
+        self.published = Event()
+
+    def publish(self, event, data):
+        """Adds a message to the buffer and wakes up all waiting clients.
+        Returns the message's sequence number."""
+        self.seq += 1
+        self.history.append((self.seq, event, data))
+        # Waiters hold on to the old event, so replacing it after setting it
+        # wakes them all without affecting the next wait.
+        published = self.published
+        self.published = Event()
+        published.set()
+        return self.seq
+
+    def since(self, cursor):
+        """Returns a pair `(missed, messages)`, where `messages` is the list of
+        `(seq, event, data)` triples published after the cursor and `missed` is
+        the number of messages after the cursor that have already been dropped.
+        A cursor from the future (for example, from before the server was
+        restarted) is treated as if it were zero."""
+        if cursor > self.seq:
+            cursor = 0
+        if not self.history or cursor == self.seq:
+            return 0, []
+        oldest = self.history[0][0]
+        missed = max(0, oldest - cursor - 1)
+        start = max(0, cursor - oldest + 1)
+        return missed, list(islice(self.history, start, None))
+
+    def wait(self, cursor, timeout=None):
+        """Like `since`, but first blocks until there is a message after the
+        cursor or until the timeout (in seconds) expires."""
+        if cursor == self.seq:
+            self.published.wait(timeout)
+        return self.since(cursor)
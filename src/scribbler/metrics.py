@@ -0,0 +1,166 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Records latency histograms and exports them for monitoring."""
+
+from scribbler.timing import monotonic
+
+
+# Upper bounds of the histogram buckets (seconds). They span everything from a
+# quick request to a long-poll that times out.
+BUCKETS = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+]
+
+# Percentiles included in the compact summary.
+PERCENTILES = [50, 95, 99]
+
+# Prefix of the names of the exported metrics.
+NAMESPACE = 'scribbler'
+
+# Metrics that are exported, with their help text.
+METRIC_HELP = {
+    'http_seconds': "Time to handle HTTP requests, by kind.",
+    'command_seconds': "Time to perform commands, by robot and command.",
+    'myro_seconds': "Time taken by Myro calls, by robot and function.",
+    'loop_seconds': "Time taken by program loop iterations, by robot and "
+                    "program."
+}
+
+
+class Histogram(object):
+
+    """Latency statistics for one kind of operation.
+
+    Besides the count, total, maximum, and latest value, it counts how many
+    values fall in each of the `BUCKETS`, so that percentiles can be estimated
+    and the whole distribution can be exported.
+    """
+
+    def __init__(self):
+        """Creates a histogram with nothing recorded yet."""
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def record(self, seconds):
+        """Records that an operation took the given number of seconds."""
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+
+    @property
+    def mean(self):
+        """The average latency in seconds."""
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, p):
+        """Returns an upper bound on the p-th percentile, which is the bound of
+        the bucket it falls in (or the maximum, if that is lower)."""
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= rank and seen > 0:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        """Returns a dictionary with the count and the mean, percentiles, and
+        maximum in milliseconds."""
+        summary = {
+            'count': self.count,
+            'mean_ms': round(1000 * self.mean, 3),
+            'max_ms': round(1000 * self.max, 3)
+        }
+        for p in PERCENTILES:
+            summary['p{}_ms'.format(p)] = round(1000 * self.percentile(p), 3)
+        return summary
+
+
+class Timer(object):
+
+    """Measures how long a block takes and records it in a histogram, for use
+    in a `with` statement."""
+
+    def __init__(self, histogram):
+        """Creates a timer that records in the given histogram."""
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(monotonic() - self.start)
+        return False
+
+
+def histogram_for(table, key):
+    """Returns the histogram for the key in the dictionary, adding one if there
+    isn't one yet."""
+    histogram = table.get(key)
+    if histogram is None:
+        histogram = table[key] = Histogram()
+    return histogram
+
+
+def prometheus(series):
+    """Formats metrics in the Prometheus text exposition format. The series are
+    triples `(metric, labels, histogram)`, where the metric is a key of
+    `METRIC_HELP` and the labels are a list of pairs."""
+    lines = []
+    by_metric = {}
+    for metric, labels, histogram in series:
+        by_metric.setdefault(metric, []).append((labels, histogram))
+    for metric in sorted(by_metric):
+        name = '{}_{}'.format(NAMESPACE, metric)
+        lines.append('# HELP {} {}'.format(name, METRIC_HELP[metric]))
+        lines.append('# TYPE {} histogram'.format(name))
+        for labels, h in sorted(by_metric[metric]):
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ['+Inf'], h.buckets):
+                cumulative += n
+                le = labels + [('le', str(bound))]
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(le), cumulative))
+            lines.append('{}_sum{} {!r}'.format(
+                name, format_labels(labels), h.total))
+            lines.append('{}_count{} {}'.format(
+                name, format_labels(labels), h.count))
+    return '\n'.join(lines) + '\n'
+
+
+def compact(series):
+    """Summarizes metrics as nested dictionaries, from the metric to each of
+    the label values in turn to the histogram's summary."""
+    tree = {}
+    for metric, labels, histogram in series:
+        node = tree.setdefault(metric, {})
+        for _, value in labels[:-1]:
+            node = node.setdefault(value, {})
+        node[labels[-1][1]] = histogram.summary()
+    return tree
+
+
+def format_labels(labels):
+    """Formats label pairs for the Prometheus text format."""
+    if not labels:
+        return ''
+    parts = ['{}="{}"'.format(k, escape(v)) for k, v in labels]
+    return '{' + ','.join(parts) + '}'
+
+
+def escape(value):
+    """Escapes a label value for the Prometheus text format."""
+    value = str(value)
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,197 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Compiles paths into the timed motions that the robot makes to trace them."""
+
+import math
+from array import array
+from collections import namedtuple
+
+from scribbler.util import deg_to_rad, rad_to_deg, equiv_angle
+
+
+# Parameters that the motions depend on. The plan has to be compiled again
+# whenever one of them changes.
+PLAN_PARAMS = [
+    'speed',
+    'rotation_speed',
+    'point_scale',
+    'dist_to_time',
+    'angle_to_time',
+    'min_rotation',
+    'corner_angle',
+    'max_curvature',
+    'arc_error'
+]
+
+# Myro functions that start each kind of motion, given the motion's speeds.
+MOTION_COMMANDS = {
+    'rotate': 'rotate',
+    'drive': 'forward',
+    'arc': 'motors'
+}
+
+# One motion of the robot. The kind is 'rotate', 'drive', or 'arc'; the index is
+# that of the point it moves towards; the heading is the robot's heading at the
+# end of the motion; the delta is the change in heading; the distance is in
+# centimetres; and the speeds are the arguments of the Myro command.
+Motion = namedtuple('Motion', [
+    'kind', 'index', 'duration', 'heading', 'delta', 'distance', 'speeds'
+])
+
+
+class MotionPlan(object):
+
+    """The motions for tracing a path, computed before the robot needs them.
+
+    The length and direction of every segment are computed once, when the
+    points arrive, since they only depend on the points. The motions depend on
+    the parameters as well, so they are compiled again from a given segment
+    onwards when a parameter changes. Segment i is the one that ends at point i,
+    and it takes one or two motions: a drive or an arc, possibly preceded by a
+    rotation. The path can grow (when it is streamed), and the segments that
+    have been drawn can be discarded.
+    """
+
+    def __init__(self, points, params, heading=math.pi / 2):
+        """Creates a plan for tracing the points (a PointArray or PointStream)
+        with the given parameters (a dictionary that is read when compiling),
+        starting with the given heading."""
+        self.points = points
+        self.params = params
+        self.first = 1
+        self.heading = heading
+        self.lengths = array('d')
+        self.angles = array('d')
+        self.motions = []
+        self.extend()
+
+    @property
+    def end(self):
+        """The index of the first segment that hasn't been planned yet."""
+        return self.first + len(self.lengths)
+
+    def extend(self):
+        """Computes the geometry of the segments ending at points that were
+        added since the last call, and compiles their motions."""
+        start = self.end
+        if start >= len(self.points):
+            return
+        pts = [self.points[i] for i in range(start - 1, len(self.points))]
+        xs = [p[0] for p in pts]
+        ys = [p[1] for p in pts]
+        dxs = [b - a for a, b in zip(xs, xs[1:])]
+        dys = [b - a for a, b in zip(ys, ys[1:])]
+        self.lengths.extend(map(math.hypot, dxs, dys))
+        self.angles.extend(map(math.atan2, dys, dxs))
+        self.compile(start)
+
+    def compile(self, start=None):
+        """Compiles the motions for the segments from `start` (by default, the
+        first one that is kept) to the end of the path."""
+        if start is None:
+            start = self.first
+        if start >= self.end:
+            return
+        heading = self.heading_before(start)
+        del self.motions[start - self.first:]
+        for i in range(start, self.end):
+            motions = self.compile_segment(i, heading)
+            heading = motions[-1].heading
+            self.motions.append(motions)
+
+    def heading_before(self, index):
+        """Returns the robot's heading at the start of the given segment."""
+        if index <= self.first:
+            return self.heading
+        return self.motions[index - 1 - self.first][-1].heading
+
+    def compile_segment(self, index, heading):
+        """Returns the list of motions for the segment, starting with the
+        given heading."""
+        p = self.params
+        j = index - self.first
+        chord = p['point_scale'] * self.lengths[j]
+        angle = self.angles[j]
+        # An arc that starts with the current heading turns twice as much as
+        # the angle between the heading and the chord, and it is longer than
+        # the chord by a factor of (a / sin a).
+        half = equiv_angle(angle - heading)
+        delta = 2 * half
+        length = chord * half / math.sin(half) if half else chord
+        if self.use_arc(half, delta, length):
+            return [self.arc(index, heading, delta, length)]
+        motions = []
+        # Don't even try to rotate if it's a very small angle, because the
+        # robot will go too far; it is better to go straight.
+        if abs(half) >= deg_to_rad(p['min_rotation']):
+            speed = p['rotation_speed']
+            duration = p['angle_to_time'] * rad_to_deg(abs(half)) / speed
+            rot_dir = 1 if half > 0 else -1
+            motions.append(Motion('rotate', index, duration, angle, half, 0,
+                                  (rot_dir * speed,)))
+        speed = p['speed']
+        duration = p['dist_to_time'] * chord / speed
+        motions.append(Motion('drive', index, duration, angle, 0, chord,
+                              (speed,)))
+        return motions
+
+    def use_arc(self, half, delta, length):
+        """Returns true if the segment should be driven as an arc, which
+        starts on the current heading and turns by `delta` over `length`
+        centimetres. The robot must be able to turn that tightly, and the arc
+        must stay within `arc_error` of the straight segment. The arc bulges
+        out further the longer it is, so only short segments are arced, such
+        as those that approximate a curve."""
+        p = self.params
+        if not 0 < abs(delta) < 2 * deg_to_rad(p['corner_angle']):
+            return False
+        if abs(delta) > deg_to_rad(p['max_curvature']) * length:
+            return False
+        radius = length / abs(delta)
+        bulge = radius * (1 - math.cos(half))
+        return bulge <= p['arc_error']
+
+    def arc(self, index, heading, delta, length):
+        """Returns the motion for driving along an arc. It is driven with one
+        motor command, which is the forward speed plus or minus the rotation
+        speed that makes the robot turn by the right amount in the same
+        time."""
+        p = self.params
+        speed = p['speed']
+        duration = p['dist_to_time'] * length / speed
+        turn = p['angle_to_time'] * rad_to_deg(delta) / duration
+        # Slow down if either wheel would have to go faster than full speed.
+        scale = max(1.0, abs(speed) + abs(turn))
+        wheels = ((speed - turn) / scale, (speed + turn) / scale)
+        return Motion('arc', index, duration * scale,
+                      equiv_angle(heading + delta), delta, length, wheels)
+
+    def motions_for(self, index):
+        """Returns the list of motions for the segment ending at point
+        `index`."""
+        return self.motions[index - self.first]
+
+    def discard(self, index):
+        """Discards the segments before the given index."""
+        n = min(index, self.end) - self.first
+        if n > 0:
+            self.heading = self.heading_before(self.first + n)
+            del self.lengths[:n]
+            del self.angles[:n]
+            del self.motions[:n]
+            self.first += n
+
+    def remaining(self, index=None, step=0):
+        """Returns the total duration of the motions from the given one (the
+        step-th motion of the segment ending at point `index`) to the end of
+        the path. By default, returns the duration of the whole plan."""
+        if index is None:
+            index = self.first
+        j = index - self.first
+        if j >= len(self.motions):
+            return 0.0
+        total = sum(m.duration for m in self.motions[j][step:])
+        for motions in self.motions[j+1:]:
+            for m in motions:
+                total += m.duration
+        return total
@@ -0,0 +1,114 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Sends motor commands to the robot without making the programs wait."""
+
+import gevent
+from gevent.event import Event
+from gevent.lock import Semaphore
+
+
+# Myro functions that set the motion of the robot. Each one completely replaces
+# the effect of the previous one, which is what allows them to be coalesced.
+MOTOR_COMMANDS = ['forward', 'backward', 'rotate', 'motors', 'stop']
+
+
+class Motors(object):
+
+    """Wraps a Myro-like module to coalesce and pipeline motor commands.
+
+    Only the latest motor command matters, since each one replaces the robot's
+    current motion. Calling one of the `MOTOR_COMMANDS` just puts it in a slot
+    and returns; a writer greenlet sends whatever is in the slot over the
+    serial link. So a `stop` immediately followed by a new motion is never
+    sent, and neither is a command identical to the one the robot is already
+    executing. Every other attribute is passed through to the wrapped module,
+    after first sending any pending motor command so that calls stay in order
+    (a sensor read after a `stop` happens with the robot stopped).
+
+    A command that fails in the writer greenlet is passed to `on_error` (if
+    given) as a message, and the writer keeps going, so that the next command
+    (most importantly a `stop`) is still sent.
+    """
+
+    def __init__(self, myro, on_error=None):
+        """Wraps the given Myro module and starts the writer greenlet. The
+        `on_error` function is called with a message when a command fails."""
+        self.myro = myro
+        self.on_error = on_error
+        self.pending = None
+        self.current = None
+        self.ready = Event()
+        self.lock = Semaphore()
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.writer = gevent.spawn(self.write_loop)
+
+    def forward(self, speed):
+        """Drives forward at the given speed."""
+        self.command('forward', speed)
+
+    def backward(self, speed):
+        """Drives backward at the given speed."""
+        self.command('backward', speed)
+
+    def rotate(self, speed):
+        """Pivots at the given speed (positive is counterclockwise)."""
+        self.command('rotate', speed)
+
+    def motors(self, left, right):
+        """Sets the speeds of the left and right wheels separately."""
+        self.command('motors', left, right)
+
+    def stop(self):
+        """Stops the motors."""
+        self.command('stop')
+
+    def command(self, name, *args):
+        """Replaces the pending motor command, if there is one, and wakes up the
+        writer greenlet."""
+        if self.pending is not None:
+            self.coalesced += 1
+        self.pending = (name, args)
+        self.ready.set()
+
+    def write_loop(self):
+        """Sends motor commands as they come in. Runs forever, even when a
+        command fails."""
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.failed += 1
+                if self.on_error:
+                    self.on_error("motor command failed: {}".format(e))
+
+    def flush(self):
+        """Sends the pending motor command now, unless the robot is already
+        executing the same command. If the command fails, the exception is
+        raised, and the robot's motion is considered unknown."""
+        with self.lock:
+            cmd = self.pending
+            if cmd is None:
+                return
+            self.pending = None
+            if cmd == self.current:
+                self.coalesced += 1
+                return
+            name, args = cmd
+            self.current = None
+            getattr(self.myro, name)(*args)
+            self.current = cmd
+            self.sent += 1
+
+    def __getattr__(self, name):
+        """Passes other functions through to the wrapped module."""
+        attr = getattr(self.myro, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            self.flush()
+            return attr(*args, **kwargs)
+        return call
@@ -0,0 +1,267 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Plans the order in which the strokes of a drawing are drawn."""
+
+import math
+from collections import deque
+from time import time
+
+from scribbler.util import dist_2d, equiv_angle
+
+
+# Number of nearby stroke ends considered when looking for improvements.
+NEIGHBOURS = 16
+
+# Maximum amount of time spent improving the order with 2-opt (seconds).
+IMPROVE_TIME = 1.0
+
+
+class Grid(object):
+
+    """A spatial hash for finding the points near a given point quickly."""
+
+    def __init__(self, entries):
+        """Creates a grid containing the `(x, y, item)` triples. The cell size
+        is chosen so that there are about as many cells as entries."""
+        xs = [e[0] for e in entries] or [0]
+        ys = [e[1] for e in entries] or [0]
+        area = (max(xs) - min(xs) + 1) * (max(ys) - min(ys) + 1)
+        self.cell = math.sqrt(area / float(max(1, len(entries))))
+        self.cells = {}
+        for entry in entries:
+            self.cells.setdefault(self.key(entry[0], entry[1]), []).append(entry)
+        keys = list(self.cells) or [(0, 0)]
+        self.bounds = (min(k[0] for k in keys), max(k[0] for k in keys),
+                       min(k[1] for k in keys), max(k[1] for k in keys))
+
+    def key(self, x, y):
+        """Returns the key of the cell containing (x,y)."""
+        return int(math.floor(x / self.cell)), int(math.floor(y / self.cell))
+
+    def remove(self, entry):
+        """Removes an entry from the grid."""
+        self.cells[self.key(entry[0], entry[1])].remove(entry)
+
+    def rings(self, x, y):
+        """Yields pairs `(bound, entries)` for square rings of cells of growing
+        size around (x,y), where `bound` is a lower bound on the distance from
+        (x,y) to any of the entries."""
+        cx, cy = self.key(x, y)
+        x0, x1, y0, y1 = self.bounds
+        reach = max(cx - x0, x1 - cx, cy - y0, y1 - cy)
+        yield 0, list(self.cells.get((cx, cy), []))
+        for r in range(1, reach + 1):
+            entries = []
+            for i in range(cx - r, cx + r + 1):
+                entries += self.cells.get((i, cy - r), [])
+                entries += self.cells.get((i, cy + r), [])
+            for j in range(cy - r + 1, cy + r):
+                entries += self.cells.get((cx - r, j), [])
+                entries += self.cells.get((cx + r, j), [])
+            yield (r - 1) * self.cell, entries
+
+    def nearest(self, x, y, k):
+        """Returns up to `k` entries nearest to (x,y), nearest first."""
+        found = []
+        for bound, entries in self.rings(x, y):
+            if len(found) >= k and found[k-1][0] <= bound:
+                break
+            found += [(dist_2d(x, y, e[0], e[1]), e) for e in entries]
+            found.sort(key=lambda f: f[0])
+        return [e for _, e in found[:k]]
+
+
+class StrokePlanner(object):
+
+    """Chooses the order and direction in which to draw a set of strokes.
+
+    Each stroke is a list of points. Between strokes, the robot turns towards
+    the next stroke, drives to it, and turns to face along it. The planner
+    minimizes the total time spent on this using a nearest-neighbour tour
+    followed by 2-opt improvement, both restricted to nearby stroke ends with a
+    spatial grid so that they scale to thousands of strokes.
+
+    A tour is a list of `(stroke, reversed)` pairs. The first element is always
+    None, which stands for the robot's starting position.
+    """
+
+    def __init__(self, strokes, drive_cost, rotate_cost, start=(0, 0),
+                 heading=math.pi / 2):
+        """Creates a planner for the strokes, starting from the given position
+        and heading. `drive_cost` converts a distance to a time, and
+        `rotate_cost` converts an angle (in radians) to a time."""
+        self.strokes = [s for s in strokes if s]
+        self.drive_cost = drive_cost
+        self.rotate_cost = rotate_cost
+        self.start = start
+        self.heading = heading
+        self.headings = [(path_heading(s[:2]), path_heading(s[-2:]))
+                         for s in self.strokes]
+
+    def start_of(self, e):
+        """Returns the point at which the tour element starts."""
+        if e is None:
+            return self.start
+        s, rev = e
+        return self.strokes[s][-1 if rev else 0]
+
+    def end_of(self, e):
+        """Returns the point at which the tour element ends."""
+        if e is None:
+            return self.start
+        s, rev = e
+        return self.strokes[s][0 if rev else -1]
+
+    def start_heading(self, e):
+        """Returns the heading of the first segment of the tour element."""
+        s, rev = e
+        if rev:
+            return flip(self.headings[s][1])
+        return self.headings[s][0]
+
+    def end_heading(self, e):
+        """Returns the heading of the last segment of the tour element."""
+        if e is None:
+            return self.heading
+        s, rev = e
+        if rev:
+            return flip(self.headings[s][0])
+        return self.headings[s][1]
+
+    def turn_cost(self, a, b):
+        """Returns the time it takes to turn from heading `a` to heading `b`."""
+        if a is None or b is None:
+            return 0
+        return self.rotate_cost(abs(equiv_angle(b - a)))
+
+    def cost(self, e1, e2):
+        """Returns the time it takes to get from the end of tour element `e1`
+        to the start of tour element `e2`, facing along it."""
+        if e2 is None:
+            return 0
+        x1, y1 = self.end_of(e1)
+        x2, y2 = self.start_of(e2)
+        heading = self.end_heading(e1)
+        total = 0
+        if (x1, y1) != (x2, y2):
+            direction = math.atan2(y2 - y1, x2 - x1)
+            total += self.turn_cost(heading, direction)
+            total += self.drive_cost(dist_2d(x1, y1, x2, y2))
+            heading = direction
+        return total + self.turn_cost(heading, self.start_heading(e2))
+
+    def tour_cost(self, tour):
+        """Returns the total travel time between the strokes of the tour."""
+        return sum(self.cost(tour[i], tour[i+1]) for i in range(len(tour) - 1))
+
+    def nearest_neighbour(self):
+        """Builds a tour by always going to the cheapest of the stroke ends
+        nearest to the robot."""
+        entries = []
+        for s, stroke in enumerate(self.strokes):
+            entries.append(stroke[0] + ((s, False),))
+            entries.append(stroke[-1] + ((s, True),))
+        grid = Grid(entries)
+        tour = [None]
+        for _ in self.strokes:
+            x, y = self.end_of(tour[-1])
+            nearby = grid.nearest(x, y, NEIGHBOURS)
+            best = min((e[2] for e in nearby),
+                       key=lambda e: self.cost(tour[-1], e))
+            s = best[0]
+            grid.remove(self.strokes[s][0] + ((s, False),))
+            grid.remove(self.strokes[s][-1] + ((s, True),))
+            tour.append(best)
+        return tour
+
+    def improve(self, tour, time_limit=IMPROVE_TIME):
+        """Improves the tour in place with 2-opt moves until no move helps or
+        the time limit (in seconds) is reached. A move reverses a section of
+        the tour, which also reverses the direction of its strokes. Only moves
+        that join the ends of strokes that are near each other are tried."""
+        n = len(tour) - 1
+        entries = []
+        for s, stroke in enumerate(self.strokes):
+            entries.append(stroke[0] + ((s, True),))
+            entries.append(stroke[-1] + ((s, False),))
+        grid = Grid(entries)
+        # Each stroke end is labelled by whether the stroke has to be reversed
+        # for its tour element to end there.
+        neighbours = {None: grid.nearest(self.start[0], self.start[1],
+                                         NEIGHBOURS)}
+        for x, y, label in entries:
+            neighbours[label] = grid.nearest(x, y, NEIGHBOURS + 1)
+        position = [0] * len(self.strokes)
+        for i in range(1, n + 1):
+            position[tour[i][0]] = i
+        # Only the tour elements next to a change need to be checked again.
+        active = deque(range(n + 1))
+        queued = [True] * (n + 1)
+        deadline = time() + time_limit
+        while active and time() < deadline:
+            k = active.popleft()
+            queued[k] = False
+            i = position[k - 1] if k else 0
+            for _, _, label in neighbours[tour[i]]:
+                j = position[label[0]]
+                # Joining the ends of tour[i] and tour[j] means reversing the
+                # section between them, if that is where they end.
+                if j == i or tour[j] != label:
+                    continue
+                a, b = min(i, j), max(i, j)
+                if self.try_move(tour, position, a, b):
+                    for m in [a, a + 1, b, b + 1]:
+                        if m <= n:
+                            e = tour[m]
+                            k = e[0] + 1 if e else 0
+                            if not queued[k]:
+                                queued[k] = True
+                                active.append(k)
+                    break
+        return tour
+
+    def try_move(self, tour, position, i, j):
+        """Reverses the section `tour[i+1:j+1]` if that makes the tour cheaper.
+        Returns true if it did."""
+        after = tour[j+1] if j < len(tour) - 1 else None
+        old = self.cost(tour[i], tour[i+1]) + self.cost(tour[j], after)
+        new = self.cost(tour[i], flip_element(tour[j]))
+        new += self.cost(flip_element(tour[i+1]), after)
+        if new >= old - 1e-9:
+            return False
+        tour[i+1:j+1] = [flip_element(e) for e in tour[j:i:-1]]
+        for k in range(i + 1, j + 1):
+            position[tour[k][0]] = k
+        return True
+
+    def plan(self, time_limit=IMPROVE_TIME):
+        """Returns the strokes in the planned order and direction."""
+        tour = self.improve(self.nearest_neighbour(), time_limit)
+        return self.strokes_for(tour)
+
+    def strokes_for(self, tour):
+        """Returns the strokes of the tour, each in its direction."""
+        return [self.strokes[s][::-1] if rev else self.strokes[s]
+                for s, rev in tour[1:]]
+
+
+def path_heading(points):
+    """Returns the heading (in standard position) of the line from the first to
+    the last of the points, or None if they coincide."""
+    (x1, y1), (x2, y2) = points[0], points[-1]
+    if (x1, y1) == (x2, y2):
+        return None
+    return math.atan2(y2 - y1, x2 - x1)
+
+
+def flip(heading):
+    """Returns the opposite heading, or None if the heading is None."""
+    if heading is None:
+        return None
+    return equiv_angle(heading + math.pi)
+
+
+def flip_element(e):
+    """Returns the tour element for the same stroke in the other direction."""
+    s, rev = e
+    return s, not rev
@@ -0,0 +1,198 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Stores paths compactly and decodes them from the formats clients send."""
+
+import base64
+import json
+import sys
+from array import array
+
+
+# Point formats that the server accepts, from most to least compact. The
+# client picks the first one that it knows how to encode.
+FORMATS = ['d16', 'f32', 'json']
+
+# Maximum number of points that a stream buffers ahead of the robot. Chunks
+# that would go over this are refused until the robot catches up.
+STREAM_CAPACITY = 4096
+
+
+class PointArray(object):
+
+    """A sequence of points stored in one flat array of doubles.
+
+    A list of tuples costs several Python objects per point, which adds up for
+    imported drawings with tens of thousands of points. This keeps the
+    coordinates in a single contiguous buffer instead, and only creates a tuple
+    for a point when it is accessed.
+    """
+
+    def __init__(self, points=()):
+        """Creates an array containing the `(x, y)` pairs."""
+        self.data = array('d')
+        for x, y in points:
+            self.data.append(x)
+            self.data.append(y)
+
+    @classmethod
+    def from_flat(cls, data):
+        """Creates an array that uses `data`, an `array('d')` of alternating x
+        and y coordinates, as its buffer (without copying it)."""
+        points = cls()
+        points.data = data
+        return points
+
+    def __len__(self):
+        return len(self.data) // 2
+
+    def __getitem__(self, i):
+        """Returns the i-th point as a tuple, or a copy of a section of the
+        array if `i` is a slice (with no step)."""
+        if isinstance(i, slice):
+            start, stop, _ = i.indices(len(self))
+            return PointArray.from_flat(self.data[2*start:2*max(start, stop)])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("point index out of range")
+        return self.data[2*i], self.data[2*i+1]
+
+    def __iter__(self):
+        data = self.data
+        for i in range(0, len(data), 2):
+            yield data[i], data[i+1]
+
+    def extend(self, points):
+        """Appends the points of another PointArray."""
+        self.data.extend(points.data)
+
+
+class PointStream(object):
+
+    """A path that arrives in numbered chunks while the robot is drawing it.
+
+    Points are indexed from the beginning of the path, like in a PointArray,
+    but the ones that the robot has already passed can be discarded. Together
+    with the capacity, this keeps the memory used by a drawing bounded no
+    matter how many points it has.
+    """
+
+    def __init__(self, capacity=STREAM_CAPACITY):
+        """Creates an empty stream that buffers up to `capacity` points."""
+        self.points = PointArray()
+        self.start = 0
+        self.capacity = capacity
+        self.origin = None
+        self.next_seq = 0
+        self.done = False
+
+    def __len__(self):
+        """Returns the number of points received so far."""
+        return self.start + len(self.points)
+
+    def __getitem__(self, i):
+        """Returns the i-th point of the path as a tuple."""
+        if i < 0:
+            i += len(self)
+        if i < self.start:
+            raise IndexError("point {} has been discarded".format(i))
+        return self.points[i - self.start]
+
+    def has_room(self, n):
+        """Returns true if `n` more points fit in the buffer. A chunk always
+        fits in an otherwise empty buffer, so that the stream can't get
+        stuck."""
+        return len(self.points) + n <= self.capacity or len(self.points) <= 1
+
+    def append(self, points):
+        """Appends a PointArray to the end of the path."""
+        self.points.extend(points)
+        self.next_seq += 1
+
+    def discard(self, index):
+        """Discards all the points before the given index."""
+        n = index - self.start
+        if n > 0:
+            del self.points.data[:2*n]
+            self.start = index
+
+
+def decode(fmt, payload, origin=None):
+    """Decodes a path sent in the given format. The points are translated so
+    that `origin` (by default, the first point) is at (0,0). Returns a
+    PointArray. Raises ValueError if the path can't be decoded."""
+    points = parse(fmt, payload)
+    return translate(points, origin or points[0])
+
+
+def parse(fmt, payload):
+    """Decodes a path sent in the given format without translating it. Raises
+    ValueError if the format is unknown or the payload is malformed."""
+    if fmt not in FORMATS:
+        raise ValueError("unknown point format '{}'".format(fmt))
+    try:
+        if fmt == 'json':
+            return parse_json(payload)
+        if fmt == 'f32':
+            return parse_f32(payload)
+        return parse_d16(payload)
+    except (TypeError, KeyError, AttributeError) as e:
+        # Bad base64 raises TypeError, and JSON of the wrong shape raises any
+        # of these.
+        raise ValueError("malformed {} points ({})".format(fmt, e))
+
+
+def translate(points, origin):
+    """Moves the points in place so that `origin` is at (0,0). Returns the
+    same PointArray."""
+    x0, y0 = origin
+    data = points.data
+    for i in range(0, len(data), 2):
+        data[i] -= x0
+        data[i+1] -= y0
+    return points
+
+
+def parse_json(payload):
+    """Parses a JSON list of objects with 'x' and 'y' keys."""
+    flat = array('d')
+    for p in json.loads(payload):
+        flat.append(float(p['x']))
+        flat.append(float(p['y']))
+    if not flat:
+        raise ValueError("no points")
+    return PointArray.from_flat(flat)
+
+
+def parse_f32(payload):
+    """Parses base64 data containing little-endian 32-bit floats, which are
+    the coordinates x0, y0, x1, y1, and so on."""
+    values = little_endian('f', base64.b64decode(payload))
+    return PointArray.from_flat(array('d', values))
+
+
+def parse_d16(payload):
+    """Parses base64 data containing little-endian 16-bit integers, which are
+    the differences in x and y from each point to the next (the first point is
+    relative to (0,0)). Coordinates are therefore whole pixels."""
+    deltas = little_endian('h', base64.b64decode(payload))
+    flat = array('d', [0.0]) * len(deltas)
+    x = y = 0.0
+    for i in range(0, len(deltas), 2):
+        x += deltas[i]
+        y += deltas[i+1]
+        flat[i] = x
+        flat[i+1] = y
+    return PointArray.from_flat(flat)
+
+
+def little_endian(typecode, data):
+    """Returns an array of the given type read from little-endian bytes. The
+    array must contain a whole number of points."""
+    values = array(typecode)
+    values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    if len(values) < 2 or len(values) % 2 != 0:
+        raise ValueError("incomplete point data")
+    return values
@@ -0,0 +1,208 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Profiles the timing of a controller's main loop."""
+
+import cProfile
+import os
+import pstats
+import tempfile
+from collections import deque
+from StringIO import StringIO
+
+import gevent
+
+
+# Number of recent samples that the rolling percentiles are computed from.
+ROLLING_SIZE = 500
+
+# Percentiles included in the report.
+PERCENTILES = [50, 95, 99]
+
+# An iteration of the loop body is an overrun if it takes longer than this
+# (seconds). The loop body should only make decisions and send commands.
+LOOP_BUDGET = 0.01
+
+# A wakeup is late if it happens this long after its deadline (seconds). Modes
+# end when the loop wakes up, so this is how much a mode can overshoot.
+LATENESS_BUDGET = 0.02
+
+# The hub is lagging if a greenlet that sleeps for `HUB_INTERVAL` wakes up more
+# than this late (seconds).
+HUB_LAG_BUDGET = 0.02
+HUB_INTERVAL = 0.05
+
+# Minimum time between warnings about the loop missing its budget (seconds).
+WARN_INTERVAL = 5.0
+
+# Default length of a cProfile capture (seconds), and the number of functions
+# listed in its summary.
+CAPTURE_TIME = 10.0
+CAPTURE_TOP = 25
+
+
+class Rolling(object):
+
+    """The most recent samples of a measurement, for rolling percentiles."""
+
+    def __init__(self, size=ROLLING_SIZE):
+        """Creates an empty window of the given size."""
+        self.samples = deque(maxlen=size)
+        self.max = 0.0
+
+    def add(self, value):
+        """Adds a sample."""
+        self.samples.append(value)
+        self.max = max(self.max, value)
+
+    def percentiles(self):
+        """Returns a dictionary with the percentiles of the samples in the
+        window, and the maximum of all samples ever, in milliseconds."""
+        ordered = sorted(self.samples)
+        report = {'n': len(ordered), 'max_ms': round(1000 * self.max, 3)}
+        for p in PERCENTILES:
+            value = 0.0
+            if ordered:
+                i = min(len(ordered) - 1, int(p / 100.0 * len(ordered)))
+                value = ordered[i]
+            report['p{}_ms'.format(p)] = round(1000 * value, 3)
+        return report
+
+
+class LoopProfiler(object):
+
+    """Measures how well a controller's main loop keeps time.
+
+    Four things are measured: the period between the starts of iterations, the
+    duration of the loop body, the lateness of wakeups scheduled for a
+    deadline (which is how much modes overshoot their durations), and the lag
+    of the gevent hub (how late a sleeping greenlet wakes up, which shows
+    whether other greenlets are hogging the CPU). Samples that miss their
+    budget are counted, and produce a warning every so often.
+
+    It can also run cProfile for a while, to see where the time goes. A
+    capture profiles the whole thread, which every controller's greenlets share,
+    so only one can run at a time across all the profilers.
+    """
+
+    # The cProfile capture that is running, if any, shared by all profilers.
+    capture = None
+
+    def __init__(self, clock, name):
+        """Creates a profiler that measures time with the clock. The name
+        identifies the robot in the names of capture files."""
+        self.clock = clock
+        self.name = name
+        self.period = Rolling()
+        self.body = Rolling()
+        self.lateness = Rolling()
+        self.hub_lag = Rolling()
+        self.overruns = 0
+        self.late = 0
+        self.lagged = 0
+        self.last_start = None
+        self.last_warning = None
+        self.warning = None
+        self.monitor = None
+        self.capture_summary = None
+
+    def start(self):
+        """Starts measuring the lag of the hub. Called when the program
+        starts."""
+        self.last_start = None
+        if self.monitor is None:
+            self.monitor = gevent.spawn(self.watch_hub)
+
+    def stop(self):
+        """Stops measuring the lag of the hub. Called when the program
+        stops."""
+        if self.monitor is not None:
+            self.monitor.kill()
+            self.monitor = None
+
+    def watch_hub(self):
+        """Sleeps over and over and records how late it wakes up. Runs until
+        killed."""
+        while True:
+            start = self.clock.time()
+            gevent.sleep(HUB_INTERVAL)
+            lag = self.clock.time() - start - HUB_INTERVAL
+            self.hub_lag.add(max(0.0, lag))
+            if lag > HUB_LAG_BUDGET:
+                self.lagged += 1
+                self.warn("hub lagged {:.0f} ms".format(1000 * lag))
+
+    def iteration(self, start, end):
+        """Records an iteration of the loop body that ran from `start` to
+        `end`."""
+        if self.last_start is not None:
+            self.period.add(start - self.last_start)
+        self.last_start = start
+        duration = end - start
+        self.body.add(duration)
+        if duration > LOOP_BUDGET:
+            self.overruns += 1
+            self.warn("loop took {:.0f} ms".format(1000 * duration))
+
+    def wakeup(self, lateness):
+        """Records a wakeup that happened `lateness` seconds after the deadline
+        it was scheduled for."""
+        lateness = max(0.0, lateness)
+        self.lateness.add(lateness)
+        if lateness > LATENESS_BUDGET:
+            self.late += 1
+            self.warn("woke up {:.0f} ms late".format(1000 * lateness))
+
+    def warn(self, message):
+        """Queues a warning, unless there was one recently."""
+        now = self.clock.time()
+        if self.last_warning is None or now - self.last_warning > WARN_INTERVAL:
+            self.last_warning = now
+            self.warning = "warning: " + message
+
+    def take_warning(self):
+        """Returns the queued warning (or None) and clears it."""
+        warning, self.warning = self.warning, None
+        return warning
+
+    def report(self):
+        """Returns the measurements as a dictionary."""
+        return {
+            'period': self.period.percentiles(),
+            'body': self.body.percentiles(),
+            'lateness': self.lateness.percentiles(),
+            'hub_lag': self.hub_lag.percentiles(),
+            'overruns': self.overruns,
+            'late': self.late,
+            'lagged': self.lagged,
+            'capturing': LoopProfiler.capture is not None
+        }
+
+    def start_capture(self, seconds=CAPTURE_TIME, done=None):
+        """Runs cProfile for the given number of seconds. Everything that runs
+        in the meantime on this thread is profiled, including the other
+        greenlets (but not work offloaded to the hub's thread pool). When it
+        finishes, `done` is called with the path of the saved profile. Returns
+        false if a capture is already running for any profiler."""
+        if LoopProfiler.capture is not None:
+            return False
+        LoopProfiler.capture = cProfile.Profile()
+        LoopProfiler.capture.enable()
+        gevent.spawn_later(seconds, self.finish_capture, done)
+        return True
+
+    def finish_capture(self, done=None):
+        """Stops the capture, saves it to a file that can be opened with
+        `pstats` or other viewers, and summarizes it. Returns the path of the
+        file."""
+        profile, LoopProfiler.capture = LoopProfiler.capture, None
+        profile.disable()
+        path = os.path.join(tempfile.gettempdir(),
+                            "scribbler-{}.prof".format(self.name))
+        profile.dump_stats(path)
+        out = StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats('cumulative').print_stats(CAPTURE_TOP)
+        self.capture_summary = out.getvalue()
+        if done:
+            done(path)
+        return path
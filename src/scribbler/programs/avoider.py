@@ -16,7 +16,9 @@ PARAM_CODES = {
     'of': 'overshoot_front',
     'os': 'overshoot_side',
     'bi': 'bias',
-    'rf': 'return_factor'
+    'rf': 'return_factor',
+    'oa': 'obstacle_max_age',
+    'on': 'obstacle_samples'
 }
 
 # Default values for the parameters of the program.
@@ -29,7 +31,9 @@ PARAM_DEFAULTS = {
     'overshoot_front': 10.0, # cm
     'overshoot_side': 14.0, # cm
     'bias': 0, # from -1 to 1
-    'return_factor': 0.75
+    'return_factor': 0.75,
+    'obstacle_max_age': 0.05, # s
+    'obstacle_samples': 3
 }
 
 # Statuses to be displayed at the beginning of each mode.
@@ -53,8 +57,8 @@ class Avoider(ModeProgram):
 
     """The fourth generation of the object avoidance program."""
 
-    def __init__(self):
-        ModeProgram.__init__(self, 0)
+    def __init__(self, robot):
+        ModeProgram.__init__(self, 0, robot)
         self.add_params(PARAM_DEFAULTS, PARAM_CODES)
 
     def reset(self):
@@ -101,31 +105,47 @@ class Avoider(ModeProgram):
             t *= 1 - m * self.params['bias']
         return self.has_elapsed(t)
 
+    def obstacle_average(self, fresh=False):
+        """Returns the average of the three obstacle sensor readings. Each one
+        is the median of the last few samples that are recent enough (see the
+        `obstacle_samples` and `obstacle_max_age` parameters), or a new reading
+        if `fresh` is true."""
+        if fresh:
+            return average(self.myro.read('obstacle'))
+        k = self.params['obstacle_samples']
+        max_age = self.params['obstacle_max_age']
+        return average(self.myro.median('obstacle', k, max_age))
+
+    def sees_obstacle(self):
+        """Returns true if the obstacle sensors detect something."""
+        return self.obstacle_average() > self.params['obstacle_thresh']
+
     def move(self):
         ModeProgram.move(self)
         direction = self.mode_direction()
         if direction == 'fwd':
-            myro.forward(self.speed)
+            self.myro.forward(self.speed)
         if direction == 'bwd':
-            myro.backward(self.speed)
+            self.myro.backward(self.speed)
         if direction == 'ccw':
-            myro.rotate(self.around_mult * self.speed)
+            self.myro.rotate(self.around_mult * self.speed)
         if direction == 'cw':
-            myro.rotate(self.around_mult * -self.speed)
+            self.myro.rotate(self.around_mult * -self.speed)
 
     def loop(self):
         ModeProgram.loop(self)
         if self.mode == 0:
             return self.goto('fwd-1')
         if self.mode == 'fwd-1':
-            d = obstacle_average()
+            d = self.obstacle_average()
             if d > self.params['obstacle_thresh']:
                 self.first_obstacle_reading = d
                 return self.goto('ccw-c')
+            self.wake_when(self.sees_obstacle)
         if self.mode == 'ccw-c':
             if self.has_rotated(self.params['compare_rotation']):
-                myro.stop()
-                d = obstacle_average()
+                self.myro.stop()
+                d = self.obstacle_average(fresh=True)
                 if d < self.first_obstacle_reading:
                     self.around_mult_f = 1
                 else:
@@ -143,8 +163,9 @@ class Avoider(ModeProgram):
                 return self.goto('cw-1')
         if self.mode == 'cw-1':
             if self.at_right_angle():
-                myro.stop()
-                if obstacle_average() > self.params['obstacle_thresh']:
+                self.myro.stop()
+                d = self.obstacle_average(fresh=True)
+                if d > self.params['obstacle_thresh']:
                     return self.goto('ccw-1')
                 else:
                     return self.goto('ccw-2')
@@ -164,15 +185,17 @@ class Avoider(ModeProgram):
             if self.has_travelled(self.params['overshoot_side']):
                 self.side = 'side'
                 return self.goto('cw-1')
-            if obstacle_average() > self.params['obstacle_thresh']:
-                myro.stop()
+            if self.sees_obstacle():
+                self.myro.stop()
                 return self.goto('ccw-1')
+            self.wake_when(self.sees_obstacle)
         if self.mode == 'fwd-5':
             if self.has_travelled(self.x_pos * self.params['return_factor']):
                 return self.goto('ccw-3')
-            if obstacle_average() > self.params['obstacle_thresh']:
-                myro.stop()
+            if self.sees_obstacle():
+                self.myro.stop()
                 return self.goto('ccw-1')
+            self.wake_when(self.sees_obstacle)
         if self.mode == 'ccw-3':
             if self.at_right_angle():
                 self.reset()
@@ -207,7 +230,3 @@ class Avoider(ModeProgram):
             elif self.heading == 'out':
                 self.heading = 'up'
 
-
-def obstacle_average():
-    """Returns the average of the three obstacle sensor readings."""
-    return average(myro.getObstacle())
@@ -2,8 +2,10 @@
 
 """Implements common functionality for Scribbler programs."""
 
+import json
 import math
-from time import time
+
+from scribbler.timing import DriftCompensator
 
 
 # Short codes for the parameters of the program.
@@ -12,7 +14,8 @@ PARAM_CODES = {
     'bf': 'beep_freq',
     's': 'speed',
     'dtt': 'dist_to_time',
-    'att': 'angle_to_time'
+    'att': 'angle_to_time',
+    'dg': 'drift_gain'
 }
 
 # Default values for the parameters of the program.
@@ -21,23 +24,42 @@ PARAM_DEFAULTS = {
     'beep_freq': 2000, # Hz
     'speed': 0.4, # from 0.0 to 1.0
     'dist_to_time': 0.07, # cm/s
-    'angle_to_time': 0.009 # rad/s
+    'angle_to_time': 0.009, # rad/s
+    'drift_gain': 0.5 # from 0.0 (no drift compensation) to 1.0
 }
 
 # Prefix used in commands that change the value of a parameter.
 PARAM_PREFIX = 'set:'
 
+# Battery readings up to this old are reused for the info command (seconds).
+BATTERY_MAX_AGE = 10
+
+# Time between loop iterations for programs that don't schedule their own
+# wakeups (seconds).
+POLL_DELAY = 0.01
+
 
 class BaseProgram(object):
 
     """Implements the general aspects of robot programs and basic server
     communcation. Also manages the parameter dictionary."""
 
-    def __init__(self):
-        """Creates a new base program."""
+    def __init__(self, robot):
+        """Creates a new base program that controls the given robot. The robot
+        provides the Myro functions and the clock for measuring time."""
+        self.robot = robot
+        self.myro = robot.myro
+        self.clock = robot.clock
         self.defaults = PARAM_DEFAULTS.copy()
         self.params = PARAM_DEFAULTS.copy()
         self.codes = PARAM_CODES.copy()
+        self.events = []
+        self.commands = {
+            'other:beep': self.beep,
+            'other:info': self.info,
+            'other:io': self.io_report,
+            'set': self.set_param
+        }
 
     def add_params(self, defaults, codes):
         """Adds parameters to the program given their default values and their
@@ -70,36 +92,60 @@ class BaseProgram(object):
         """The inverse of `angle_to_time`."""
         return self.speed * time / self.params['angle_to_time']
 
+    def add_commands(self, commands):
+        """Adds commands to the program given a dictionary from command names
+        (see `protocol.parse`) to the methods that handle them. Each method
+        takes a Request and returns the reply."""
+        self.commands.update(commands)
+
+    def handle(self, request):
+        """Performs the action requested by the controller and returns the
+        reply (usually a status message). Returns None if the program has no
+        such command."""
+        handler = self.commands.get(request.name)
+        if handler is None:
+            return None
+        return handler(request)
+
+    def beep(self, request):
+        """Beeps."""
+        self.myro.beep(self.params['beep_len'], self.params['beep_freq'])
+        return "successful beep"
+
+    def info(self, request):
+        """Returns the battery voltage."""
+        battery = self.myro.read('battery', BATTERY_MAX_AGE)
+        return "battery: " + str(battery)
+
+    def io_report(self, request):
+        """Returns the statistics of the serial link."""
+        return self.myro.report()
+
+    def set_param(self, request):
+        """Sets a parameter given as 'code=value', resets it with
+        'code=default' (or any prefix of it), or returns its value with
+        'code=' or 'code=?'."""
+        code, _, value = request.arg.partition('=')
+        if not code in self.codes:
+            return "invalid code: " + code
+        name = self.codes[code]
+        # Return the value of the parameter.
+        if value == "" or value == "?":
+            return name + " = " + str(self.params[name])
+        # Reset the parameter to its default.
+        if "default".startswith(value):
+            n = self.defaults[name]
+        else:
+            try:
+                n = float(value)
+            except ValueError:
+                return "NaN: " + value
+        # Set the parameter to the new value.
+        self.params[name] = n
+        return name + " = " + str(n)
+
     # Subclasses should override the following methods (and call super).
-    # `__call__` must return a status, and `loop` should sometimes.
-
-    def __call__(self, command):
-        """Performs an action according to the command passed down from the
-        controller, and returns a status message."""
-        if command == 'other:beep':
-            myro.beep(self.params['beep_len'], self.params['beep_freq'])
-            return "successful beep"
-        if command == 'other:info':
-            return "battery: " + str(myro.getBattery())
-        if command.startswith(PARAM_PREFIX):
-            code, value = command[len(PARAM_PREFIX):].split('=')
-            if not code in self.codes:
-                return "invalid code: " + code
-            name = self.codes[code]
-            # Return the value of the parameter.
-            if value == "" or value == "?":
-                return name + " = " + str(self.params[name])
-            # Reset the parameter to its default.
-            if "default".startswith(value):
-                n = self.defaults[name]
-            else:
-                try:
-                    n = float(value)
-                except ValueError:
-                    return "NaN: " + value
-            # Set the parameter to the new value.
-            self.params[name] = n
-            return name + " = " + str(n)
+    # `loop` should sometimes return a status.
 
     def start(self):
         """Called when the controller is started."""
@@ -107,7 +153,7 @@ class BaseProgram(object):
 
     def stop(self):
         """Called when the controller is stopped."""
-        myro.stop()
+        self.myro.stop()
 
     def reset(self):
         """Resets the program to its initial state."""
@@ -117,14 +163,40 @@ class BaseProgram(object):
         """The main loop of the program."""
         pass
 
+    def next_wake(self):
+        """Tells the controller when to call `loop` next. Returns a pair
+        `(delay, watch)`, where `delay` is the number of seconds to wait and
+        `watch` is a function that returns true when an awaited condition is
+        met (the controller polls it in the meantime). Either can be None. If
+        both are None, the loop waits until the controller is woken up by a
+        command. By default, the loop is polled every `POLL_DELAY` seconds."""
+        return POLL_DELAY, None
+
+    def trace(self):
+        """Returns a description of the robot's motion for the client to
+        animate, or None if the program doesn't support tracing."""
+        return None
+
+    def emit(self, event, data):
+        """Queues an event for the controller to publish to the clients. The
+        data is encoded as JSON."""
+        self.events.append((event, json.dumps(data)))
+
+    def take_events(self):
+        """Returns the queued events and forgets them."""
+        events = self.events
+        self.events = []
+        return events
+
 
 class ModeProgram(BaseProgram):
 
     """A program that operates in one mode per distinct motion."""
 
-    def __init__(self, initial_mode):
+    def __init__(self, initial_mode, robot):
         """Creates a new ModeProgram it its default state."""
-        BaseProgram.__init__(self)
+        BaseProgram.__init__(self, robot)
+        self.drift = DriftCompensator()
         self.initial_mode = initial_mode
         self.reset()
 
@@ -134,11 +206,16 @@ class ModeProgram(BaseProgram):
         self.mode = self.initial_mode
         self.start_time = 0
         self.pause_time = 0
+        self.deadline = None
+        self.watch = None
+        self.timed_out = False
+        # Run the loop right away to begin the first mode.
+        self.wake_at(self.start_time)
 
     def stop(self):
         """Pauses and records the current time."""
         BaseProgram.stop(self)
-        self.pause_time = time()
+        self.pause_time = self.clock.time()
 
     def no_start(self):
         """If the program cannot be started at this time, returns a string
@@ -149,27 +226,94 @@ class ModeProgram(BaseProgram):
         """Resumes the program and fixes the timer so that the time while the
         program was paused doesn't count towards the mode's time."""
         BaseProgram.start(self)
-        self.start_time += time() - self.pause_time
+        paused = self.clock.time() - self.pause_time
+        self.start_time += paused
+        if self.deadline is not None:
+            self.deadline += paused
         self.move()
+        self.emit_segment()
 
     def goto_mode(self, mode):
         """Stops the robot and switches to the given mode. Resets the timer and
         starts the new mode immediately."""
-        myro.stop()
+        self.myro.stop()
         self.end_mode()
         self.mode = mode
-        self.start_time = time()
+        self.start_time = self.clock.time()
+        self.timed_out = False
         self.begin_mode()
         self.move()
+        self.emit_segment()
+        # Run the loop again right away so that the new mode can schedule its
+        # own wakeups.
+        self.wake_at(self.start_time)
+
+    def segment(self):
+        """Returns a dictionary describing the motion of the current mode for
+        the client to animate, or None if the program doesn't support this.
+        The motion is described when it starts, so that the client can follow
+        it without polling."""
+        return None
+
+    def emit_segment(self):
+        """Queues a 'segment' event describing the current mode's motion. The
+        'elapsed' entry is the time the mode has been running, which is only
+        nonzero when the program is resumed in the middle of it."""
+        seg = self.segment()
+        if seg is not None:
+            seg['start'] = self.start_time
+            seg['elapsed'] = self.mode_time()
+            self.emit('segment', seg)
+
+    def loop(self):
+        """Forgets the wakeups scheduled by the previous iteration. Subclasses
+        must call this before checking any conditions."""
+        BaseProgram.loop(self)
+        self.deadline = None
+        self.watch = None
+
+    def wake_at(self, t):
+        """Schedules the next loop iteration at time `t` at the latest."""
+        if self.deadline is None or t < self.deadline:
+            self.deadline = t
+
+    def wake_when(self, condition):
+        """Schedules the next loop iteration for when `condition` (a function
+        taking no arguments) returns true."""
+        self.watch = condition
+
+    def next_wake(self):
+        """Wakes up at the earliest deadline or watched condition scheduled by
+        the last loop iteration. If neither was scheduled, the mode has nothing
+        left to wait for, so the loop is only run again when woken up."""
+        if self.deadline is None:
+            return None, self.watch
+        return max(0, self.deadline - self.clock.time()), self.watch
 
     def mode_time(self):
         """Returns the time that has elapsed since the mode begun."""
-        return time() - self.start_time
+        return self.clock.time() - self.start_time
 
     def has_elapsed(self, t):
         """Returns true if `t` seconds have elapsed sicne the current mode begun
-        and false otherwise."""
-        return self.mode_time() > t
+        and false otherwise. In the latter case, schedules a wakeup for when
+        they will have elapsed.
+
+        The duration is shortened to compensate for the usual lateness in
+        ending a mode, and the first time it returns true during a mode, the
+        actual lateness is measured to improve the compensation.
+        """
+        end = self.start_time + self.drift.adjust(t)
+        # Compare with the end time itself, not the elapsed time, so that a
+        # wakeup scheduled for exactly that time always counts as elapsed.
+        if self.clock.time() >= end:
+            if not self.timed_out:
+                self.timed_out = True
+                self.drift.record(t, self.mode_time(),
+                                  self.params['drift_gain'])
+            return True
+        self.wake_at(end)
+        return False
 
     def has_travelled(self, dist):
         """Returns true if the robot has driven `dist` centimetres driving the
@@ -20,23 +20,21 @@ class Calib(ModeProgram):
 
     """Program for calibrating the `att` parameter."""
 
-    def __init__(self):
-        ModeProgram.__init__(self, 0)
+    def __init__(self, robot):
+        ModeProgram.__init__(self, 0, robot)
         self.running = False
         self.add_params(PARAM_DEFAULTS, PARAM_CODES)
-
-    def __call__(self, command):
-        p_status = ModeProgram.__call__(self, command)
-        if p_status:
-            return p_status
-        if command == 'short:att':
-            if self.running:
-                t = self.mode_time()
-                s = self.speed
-                angle = self.params['calib_angle']
-                return str(t * s / angle)
-            else:
-                return "program not running"
+        self.add_commands({'short:att': self.short_att})
+
+    def short_att(self, request):
+        """Returns the `att` value measured by the calibration so far."""
+        if self.running:
+            t = self.mode_time()
+            s = self.speed
+            angle = self.params['calib_angle']
+            return str(t * s / angle)
+        else:
+            return "program not running"
 
     def start(self):
         ModeProgram.start(self)
@@ -47,4 +45,4 @@ class Calib(ModeProgram):
         self.running = False
 
     def move(self):
-        myro.rotate(self.speed)
+        self.myro.rotate(self.speed)
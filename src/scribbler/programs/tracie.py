@@ -4,9 +4,15 @@
 
 import json
 import math
-from time import time
 
-from scribbler.util import deg_to_rad, rad_to_deg, dist_2d, equiv_angle
+from gevent import get_hub
+
+from scribbler.geometry import merge_collinear, simplify
+from scribbler.motion import MOTION_COMMANDS, PLAN_PARAMS, MotionPlan
+from scribbler.planning import StrokePlanner
+from scribbler.points import FORMATS, PointArray, PointStream, decode, parse
+from scribbler.points import translate
+from scribbler.util import rad_to_deg
 from scribbler.programs.base import ModeProgram
 
 
@@ -14,7 +20,11 @@ from scribbler.programs.base import ModeProgram
 PARAM_CODES = {
     'rs': 'rotation_speed',
     'ps': 'point_scale',
-    'mr': 'min_rotation'
+    'mr': 'min_rotation',
+    'st': 'simplify_tolerance',
+    'ca': 'corner_angle',
+    'mc': 'max_curvature',
+    'ae': 'arc_error'
 }
 
 # Default values for the parameters of the program.
@@ -23,146 +33,288 @@ PARAM_DEFAULTS = {
     'angle_to_time': 0.0052,
     'rotation_speed': 0.1, # 0.4, # from 0.0 to 1.0
     'point_scale': 0.02, #0.05, # cm/px
-    'min_rotation': 2 # deg
+    'min_rotation': 2, # deg
+    'simplify_tolerance': 0.05, # cm
+    'corner_angle': 30, # deg (0 to always stop and rotate)
+    'max_curvature': 20, # deg/cm
+    'arc_error': 0.05 # cm
 }
 
-POINTS_PREFIX = 'points:'
-
 
 class Tracie(ModeProgram):
 
     """Tracie takes a set of points as input and draws the shape with a pen."""
 
-    def __init__(self):
-        # self.new_points is the list of points that will be used next.
-        # It persists across resets.
-        self.new_points = []
-        ModeProgram.__init__(self, 0)
+    def __init__(self, robot):
+        # self.new_points is the list of points that will be used next (or a
+        # PointStream if they are being streamed). It persists across resets.
+        ModeProgram.__init__(self, 0, robot)
         self.add_params(PARAM_DEFAULTS, PARAM_CODES)
+        self.add_commands({
+            'short:point-formats': self.point_formats,
+            'short:trace': self.short_trace,
+            'short:eta': self.short_eta,
+            'points': self.receive_points,
+            'strokes': self.receive_strokes,
+            'stream': self.receive_stream
+        })
+        self.set_points(PointArray())
 
     def reset(self):
         ModeProgram.reset(self)
         self.points = None # path the the robot draws
+        self.plan = None # motions for drawing the path
         self.index = 0 # index of point robot is going towards
+        self.step = 0 # index of the current motion in the segment's motions
+        self.motion = None # the current motion
         self.heading = math.pi / 2 # the current heading, in standard position
-        self.rot_dir = 1 # 1 for counterclockwise, -1 for clockwise
-        self.go_for = 0 # the time duration of the robot's current action
-        # These two are only needed because the status method needs to access
-        # them after they have been set by the time setting methods.
-        self.delta_angle = 0
-        self.delta_pos = 0
-
-    def __call__(self, command):
-        p_status = ModeProgram.__call__(self, command)
-        if p_status:
-            return p_status
-        if command.startswith(POINTS_PREFIX):
-            json_str = command[len(POINTS_PREFIX):]
-            self.new_points = self.transform_points(json.loads(json_str))
-            return "received {} points".format(str(len(self.new_points)))
-        if command == 'short:trace':
-            if self.mode == 0:
-                return "0 {}".format(self.heading)
-            if self.mode == 'halt':
-                return "{} {}".format(len(self.points)-1, self.heading)
-            t = self.mode_time()
-            T = self.go_for
-            i = self.index - 1
-            delta_i = 1
-            theta = self.heading
-            delta_theta = 0
-            if self.mode == 'rotate':
-                delta_i = 0
-                delta_theta = self.delta_angle
-                theta -= delta_theta
-            vals = [t, T, i, delta_i, theta, delta_theta]
-            return ' '.join(map(str, vals));
-
-    def transform_points(self, data):
-        """Parses the point data and translates all points to make the firs
-        point the origin. Returns the resulting points list."""
-        x0 = float(data[0]['x'])
-        y0 = float(data[0]['y'])
-        return [(float(p['x']) - x0, float(p['y']) - y0) for p in data]
+
+    def set_param(self, request):
+        """Sets a parameter, and compiles the motions again if they depend on
+        it."""
+        msg = ModeProgram.set_param(self, request)
+        code = request.arg.partition('=')[0]
+        if self.codes.get(code) in PLAN_PARAMS:
+            self.replan()
+        return msg
+
+    def point_formats(self, request):
+        """Returns the list of point formats that the program accepts."""
+        return FORMATS
+
+    def receive_points(self, request):
+        """Uses the points for the next drawing. They are sent as
+        'points-FORMAT:POINTS', or as 'points:POINTS' for JSON. The reply
+        includes the points that were kept after simplifying, relative to the
+        first point, since those are the ones that trace indices refer to."""
+        try:
+            points = decode(request.format or 'json', request.arg)
+        except ValueError as e:
+            return "invalid points: {}".format(e)
+        self.set_points(self.simplify_points(points))
+        removed = len(points) - len(self.new_points)
+        return {
+            'message': "received {} points ({} removed), eta {:.1f} s".format(
+                len(points), removed, self.new_plan.remaining()),
+            'kept': list(self.new_points)
+        }
+
+    def receive_strokes(self, request):
+        """Plans the order of the strokes sent as JSON and uses the resulting
+        path for the next drawing. Planning a large drawing can take over a
+        second, so it runs on a thread to keep the server and the robot going
+        in the meantime. The web client only sends single paths, so strokes
+        are for other clients, such as scripts that import drawings."""
+        try:
+            strokes = self.transform_strokes(json.loads(request.arg))
+        except ValueError as e:
+            return "invalid strokes: {}".format(e)
+        if not strokes:
+            return "no strokes"
+        points, saved = get_hub().threadpool.apply(self.plan_strokes,
+                                                   (strokes,))
+        self.set_points(self.simplify_points(points))
+        return "received {} strokes ({:.1f} s of travel saved)".format(
+            len(strokes), saved)
+
+    def short_trace(self, request):
+        """Returns the state of the current mode (see `trace`)."""
+        return self.trace()
+
+    def short_eta(self, request):
+        """Returns the time left to finish the drawing."""
+        return "eta {:.1f} s".format(self.eta())
 
     @property
-    def speed(self):
-        # This looks wrong, but the speed is actually used just before the mode
-        # switch, so it needs to be this way.
-        if self.mode == 'drive':
-            return self.params['rotation_speed']
-        return self.params['speed']
+    def streaming(self):
+        """True if the points are being streamed in chunks."""
+        return isinstance(self.new_points, PointStream)
+
+    def receive_stream(self, request):
+        """Handles a message of the streaming protocol, which is 'stream:begin',
+        then 'stream:SEQ-FORMAT:POINTS' for each chunk, and finally
+        'stream:end'. Returns the reply. A chunk is acknowledged with 'ack'
+        followed by the next sequence number expected, which is also the reply
+        to a chunk sent twice. A chunk that arrives out of order gets 'resend'
+        instead, and one that doesn't fit in the buffer yet gets 'wait'. The
+        reply to a new chunk also includes the points kept from it (see
+        `receive_points`), since the stream forgets points once they are
+        drawn."""
+        message = request.arg
+        if message == 'begin':
+            self.set_points(PointStream())
+            return "stream started"
+        if not self.streaming:
+            return "no stream"
+        stream = self.new_points
+        if message == 'end':
+            stream.done = True
+            return "stream ended ({} points)".format(len(stream))
+        header, _, payload = message.partition(':')
+        seq, _, fmt = header.partition('-')
+        try:
+            seq = int(seq)
+        except ValueError:
+            return "invalid sequence number: " + seq
+        if seq < stream.next_seq:
+            return "ack {}".format(stream.next_seq)
+        if seq > stream.next_seq or stream.done:
+            return "resend {}".format(stream.next_seq)
+        try:
+            points = parse(fmt or 'json', payload)
+        except ValueError as e:
+            return "invalid points: {}".format(e)
+        if not stream.has_room(len(points)):
+            return "wait {}".format(stream.next_seq)
+        if stream.origin is None:
+            stream.origin = points[0]
+        translate(points, stream.origin)
+        if len(stream) > 0:
+            # Simplify starting from the last point received, without adding
+            # it again, so that the chunks join up.
+            joined = [stream[-1]] + list(points)
+            points = self.simplify_points(joined)[1:]
+        else:
+            points = self.simplify_points(points)
+        stream.append(points)
+        self.new_plan.extend()
+        return {
+            'message': "ack {}".format(stream.next_seq),
+            'kept': list(points)
+        }
+
+    def set_points(self, points):
+        """Sets the points that will be used next, and plans their motions."""
+        self.new_points = points
+        self.new_plan = MotionPlan(points, self.params)
+
+    def replan(self):
+        """Compiles the motions again after a parameter has changed. While the
+        robot is drawing, only the segments it hasn't started are affected."""
+        running = self.plan is not None and self.mode not in (0, 'halt')
+        if running:
+            self.plan.compile(self.index + 1)
+        if not running or self.new_plan is not self.plan:
+            self.new_plan.compile()
+
+    def eta(self):
+        """Returns the estimated time until the drawing is finished, or the
+        time it will take to draw the points that were sent most recently if
+        the robot isn't drawing."""
+        if self.mode in (0, 'halt'):
+            return self.new_plan.remaining()
+        left = self.plan.remaining(self.index, self.step)
+        if self.motion is not None and self.mode != 'wait':
+            left -= min(self.mode_time(), self.motion.duration)
+        return left
+
+    def transform_strokes(self, data):
+        """Parses a list of strokes, each a list of points in the JSON format,
+        and translates all points to make the first point of the first stroke
+        the origin. Empty strokes are dropped. Returns the list of strokes.
+        Raises ValueError if the data doesn't have that shape."""
+        try:
+            strokes = [s for s in data if s]
+            if not strokes:
+                return []
+            x0 = float(strokes[0][0]['x'])
+            y0 = float(strokes[0][0]['y'])
+            return [[(float(p['x']) - x0, float(p['y']) - y0) for p in s]
+                    for s in strokes]
+        except (TypeError, KeyError, AttributeError) as e:
+            raise ValueError("malformed strokes ({})".format(e))
+
+    def plan_strokes(self, strokes):
+        """Chooses the order and direction of the strokes that minimize the
+        time spent travelling between them, starting from the origin. Returns
+        the path joining the strokes and the travel time saved compared to
+        drawing them as they were given. The given order is kept if it is
+        better than the planned one."""
+        planner = StrokePlanner(strokes, self.drive_cost, self.rotate_cost)
+        given = [None] + [(i, False) for i in range(len(planner.strokes))]
+        planned = planner.improve(planner.nearest_neighbour())
+        tour = min([given, planned], key=planner.tour_cost)
+        saved = planner.tour_cost(given) - planner.tour_cost(tour)
+        points = [(0.0, 0.0)]
+        for stroke in planner.strokes_for(tour):
+            points += stroke
+        return points, saved
+
+    def drive_cost(self, length):
+        """Returns how long it takes to drive along a line that is `length`
+        pixels long in the drawing."""
+        distance = self.params['point_scale'] * length
+        return self.params['dist_to_time'] * distance / self.params['speed']
+
+    def rotate_cost(self, angle):
+        """Returns how long it takes to rotate by `angle` radians."""
+        att = self.params['angle_to_time']
+        return att * rad_to_deg(angle) / self.params['rotation_speed']
+
+    def simplify_points(self, points):
+        """Removes points that don't change the shape of the path by more than
+        the simplification tolerance, as well as repeated and collinear points.
+        Returns the resulting points as a PointArray."""
+        # The tolerance is in centimetres, but the points are still in pixels.
+        tolerance = self.params['simplify_tolerance']
+        tolerance /= self.params['point_scale']
+        return PointArray(merge_collinear(simplify(points, tolerance)))
 
     def is_mode_done(self):
         """Returns true if the current mode is finished, and false otherwise.
         The 'halt' mode is never done."""
         z = self.mode == 0
         halt = self.mode == 'halt'
-        return z or (not halt and self.has_elapsed(self.go_for))
+        if self.mode == 'wait':
+            return not self.awaiting_points()
+        return z or (not halt and self.has_elapsed(self.motion.duration))
+
+    def awaiting_points(self):
+        """Returns true if the robot has reached the last point received, but
+        more points are still being streamed."""
+        return (self.streaming and not self.points.done
+                and self.index >= len(self.points))
 
     def next_mode(self):
-        """Switches to the next mode and starts it."""
+        """Switches to the next mode and starts it. The motions have already
+        been planned, so this just moves on to the next one."""
         if self.mode == 'halt':
             return
         if self.mode == 0:
-            # Use the points that were sent most recently.
-            self.points = self.new_points[:]
-        if self.mode == 'rotate':
-            self.set_drive_time()
-            self.goto_mode('drive')
-        elif self.mode == 0 or self.mode == 'drive':
-            self.index += 1
-            if self.index < len(self.points):
-                self.set_rotate_time()
-                # Don't even try to rotate if it's a very small angle, because
-                # the robot will go too far; it is better to go straight.
-                min_rad = deg_to_rad(self.params['min_rotation'])
-                if abs(self.delta_angle) < min_rad:
-                    self.set_drive_time()
-                    self.goto_mode('drive')
+            # Use the points that were sent most recently. They are replaced,
+            # not changed, when new points are sent (unless they are being
+            # streamed), so they don't need to be copied.
+            self.points = self.new_points
+            self.plan = self.new_plan
+        if self.mode in MOTION_COMMANDS and (
+                self.step + 1 < len(self.plan.motions_for(self.index))):
+            self.step += 1
+        else:
+            if self.mode != 'wait':
+                self.index += 1
+                self.step = 0
+            if self.streaming:
+                self.points.discard(self.index - 1)
+                self.plan.discard(self.index)
+            if self.index >= len(self.points):
+                if self.awaiting_points():
+                    self.goto_mode('wait')
                 else:
-                    self.goto_mode('rotate')
-            else:
-                self.goto_mode('halt')
-
-    def set_drive_time(self):
-        """Sets the time duration for which the robot should drive in order to
-        get to the next point."""
-        x1, y1 = self.points[self.index -1]
-        x2, y2 = self.points[self.index]
-        # Scale by the point_sacle now, rather than in the transform method,
-        # because the user can change this value at any time.
-        distance = self.params['point_scale'] * dist_2d(x1, y1, x2, y2)
-        self.go_for = self.dist_to_time(distance)
-        self.delta_pos = distance
-
-    def set_rotate_time(self):
-        """Sets the time duration for which the robot should rotate in order to
-        be facing the next point."""
-        new_heading = self.next_point_angle()
-        delta = equiv_angle(new_heading - self.heading)
-        self.rot_dir = 1 if delta > 0 else -1
-        self.go_for = self.angle_to_time(rad_to_deg(self.rot_dir * delta))
-        self.heading = new_heading
-        self.delta_angle = delta
-
-    def next_point_angle(self):
-        """Calculates the angle that the line connecting the current point and
-        the next point makes in standard position."""
-        x1, y1 = self.points[self.index-1]
-        x2, y2 = self.points[self.index]
-        return math.atan2(y2 - y1, x2 - x1)
+                    self.goto_mode('halt')
+                return
+        self.motion = self.plan.motions_for(self.index)[self.step]
+        self.heading = self.motion.heading
+        self.goto_mode(self.motion.kind)
 
     def move(self):
         """Makes Myro calls to move the robot according to the current mode.
         Called when the mode is begun and whenever the program is resumed."""
         ModeProgram.move(self)
-        if self.mode == 0 or self.mode == 'halt':
-            myro.stop()
-        if self.mode == 'drive':
-            myro.forward(self.speed)
-        if self.mode == 'rotate':
-            myro.rotate(self.rot_dir * self.speed)
+        if self.mode in (0, 'halt', 'wait'):
+            self.myro.stop()
+        if self.mode in MOTION_COMMANDS:
+            fn = getattr(self.myro, MOTION_COMMANDS[self.mode])
+            fn(*self.motion.speeds)
 
     def status(self):
         """Return the status message that should be displayed at the beginning
@@ -171,16 +323,62 @@ class Tracie(ModeProgram):
             return "impossible"
         if self.mode == 'halt':
             return "finished drawing"
+        if self.mode == 'wait':
+            return "waiting for points"
+        m = self.motion
         if self.mode == 'drive':
-            return "drive {:.2f} cm".format(self.delta_pos)
+            return "drive {:.2f} cm".format(m.distance)
         if self.mode == 'rotate':
-            return "rotate {:.2f} degrees".format(rad_to_deg(self.delta_angle))
+            return "rotate {:.2f} degrees".format(rad_to_deg(m.delta))
+        if self.mode == 'arc':
+            return "arc {:.2f} cm, {:.2f} degrees".format(
+                m.distance, rad_to_deg(m.delta))
 
     def no_start(self):
+        if self.streaming and self.new_points.start > 0:
+            return "stream already drawn (send it again)"
         if len(self.new_points) <= 1:
             return "not enough points"
         return False
 
+    def trace(self):
+        """Returns the state of the current mode, which the client uses to
+        animate the robot's position while it is tracing."""
+        if self.mode == 0:
+            return "0 {}".format(self.heading)
+        if self.mode == 'halt':
+            return "{} {}".format(len(self.points)-1, self.heading)
+        if self.mode == 'wait':
+            return "{} {}".format(self.index-1, self.heading)
+        m = self.motion
+        t = self.mode_time()
+        T = m.duration
+        i = self.index - 1
+        delta_i = 0 if m.kind == 'rotate' else 1
+        theta = m.heading - m.delta
+        delta_theta = m.delta
+        vals = [t, T, i, delta_i, theta, delta_theta]
+        return ' '.join(map(str, vals))
+
+    def segment(self):
+        """Describes the current motion for the client: the index of the point
+        it starts from, its kind, its planned duration, the heading at its
+        start, and the change in heading. When the robot isn't moving, only the
+        index and the heading are given."""
+        if self.mode in (0, 'halt', 'wait'):
+            index = 0 if self.mode == 0 else self.index - 1
+            if self.mode == 'halt':
+                index = len(self.points) - 1
+            return {'index': index, 'heading': self.heading}
+        m = self.motion
+        return {
+            'index': self.index - 1,
+            'kind': m.kind,
+            'duration': m.duration,
+            'heading': m.heading - m.delta,
+            'delta': m.delta
+        }
+
     def loop(self):
         ModeProgram.loop(self)
         if self.is_mode_done():
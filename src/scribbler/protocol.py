@@ -0,0 +1,108 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Parses the commands that clients send and encodes the replies."""
+
+import json
+from collections import namedtuple
+
+
+# Version of the structured protocol. Clients send it with every batch, and
+# batches for any other version are refused.
+VERSION = 1
+
+# Categories of plain-text commands whose name includes the word after the
+# colon, as in 'short:sync'. The name of any other command is the part before
+# the colon, as in 'set:s=0.4' (and before a dash, as in 'points-f32:...').
+CATEGORIES = ['short', 'long', 'control', 'other']
+
+# How replies with structured data are written for plain-text commands, which
+# predate the structured protocol. Replies that are strings are sent as they
+# are, and the data of other commands is encoded as JSON.
+TEXT_REPLIES = {
+    'short:sync': lambda d: "{program} {running} {can_reset}".format(**d),
+    'short:robots': ' '.join,
+    'short:point-formats': ' '.join,
+    'points': lambda d: d['message'],
+    'stream': lambda d: d['message'],
+    'short:connections': lambda d: (
+        "{connections} connections ({active} open), {requests} requests "
+        "({reused} reused, {per_connection:.1f} per connection), "
+        "{rate:.2f} requests/s, {long_polls} long-polls ({refused} refused)"
+        ).format(**d),
+    'short:profile': lambda d: (
+        "period p50 {period[p50_ms]} ms, body p95 {body[p95_ms]} ms, "
+        "late p95 {lateness[p95_ms]} ms, hub lag p95 {hub_lag[p95_ms]} ms; "
+        "{overruns} overruns, {late} late, {lagged} lagged"
+        ).format(**d)
+}
+
+# One command: its name (which selects the handler), its argument (the text
+# after the name, without the colon), and an optional format (the text after
+# the dash in the plain-text form).
+Request = namedtuple('Request', ['name', 'arg', 'format'])
+
+
+class ProtocolError(Exception):
+
+    """Raised when a batch of requests can't be understood at all."""
+
+    pass
+
+
+def parse(command):
+    """Parses a plain-text command, which is one of 'category:name',
+    'category:name:arg', 'name:arg', or 'name-format:arg'. Returns a
+    Request."""
+    head, _, rest = command.partition(':')
+    if head in CATEGORIES:
+        name, _, arg = rest.partition(':')
+        return Request(head + ':' + name, arg, None)
+    name, _, fmt = head.partition('-')
+    return Request(name, rest, fmt or None)
+
+
+def from_json(obj):
+    """Converts a request from a batch, which is either a plain-text command
+    or an object with 'cmd' and optionally 'arg' and 'format', into a
+    Request."""
+    if isinstance(obj, basestring):
+        return parse(obj)
+    if not isinstance(obj, dict) or 'cmd' not in obj:
+        raise ProtocolError("request without 'cmd'")
+    return Request(obj['cmd'], obj.get('arg', ''), obj.get('format'))
+
+
+def decode_batch(data):
+    """Decodes a batch, which is a JSON object with the protocol version 'v'
+    and a list of requests 'batch'. Returns the list of Requests."""
+    try:
+        obj = json.loads(data)
+    except ValueError:
+        raise ProtocolError("invalid JSON")
+    if not isinstance(obj, dict) or obj.get('v') != VERSION:
+        raise ProtocolError("unsupported protocol version")
+    return [from_json(r) for r in obj.get('batch', [])]
+
+
+def encode_replies(replies):
+    """Encodes the replies to a batch, which are pairs `(ok, data)`, as a JSON
+    object with the protocol version and a list of replies. Each reply has
+    'ok', and either 'data' or (if it failed) 'error'."""
+    encoded = []
+    for ok, data in replies:
+        encoded.append({'ok': True, 'data': data} if ok else
+                       {'ok': False, 'error': data})
+    return json.dumps({'v': VERSION, 'replies': encoded})
+
+
+def encode_error(message):
+    """Encodes the reply to a batch that couldn't be decoded."""
+    return json.dumps({'v': VERSION, 'error': message})
+
+
+def text_reply(name, data):
+    """Returns the reply to a plain-text command as a string, or None if there
+    is no reply."""
+    if data is None or isinstance(data, basestring):
+        return data
+    return TEXT_REPLIES.get(name, json.dumps)(data)
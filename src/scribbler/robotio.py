@@ -0,0 +1,72 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Runs the blocking robot I/O on its own thread to keep the server responsive."""
+
+from gevent.threadpool import ThreadPool
+
+from scribbler.metrics import histogram_for
+from scribbler.timing import Clock
+
+
+class RobotIO(object):
+
+    """Wraps a Myro-like module so that its functions run on a dedicated thread.
+
+    Myro talks to the robot over a serial link with blocking calls. Made from a
+    greenlet, such a call would freeze the whole gevent hub, so no requests
+    would be answered while waiting for the robot (not even a request to stop
+    it). Through this wrapper, a call only blocks the greenlet that made it.
+    The calls run one at a time, in order, because the serial link can't be
+    shared.
+    """
+
+    def __init__(self, myro):
+        """Wraps the given Myro module and starts the I/O thread."""
+        self.myro = myro
+        self.pool = ThreadPool(1)
+        self.clock = Clock()
+        self.stats = {}
+        self.depth = 0
+
+    def submit(self, name, *args, **kwargs):
+        """Queues a call to the named Myro function on the I/O thread. Returns
+        a future (a gevent AsyncResult) for its return value."""
+        fn = getattr(self.myro, name)
+        histogram_for(self.stats, name)
+        self.depth += 1
+        future = self.pool.spawn(self.timed, name, fn, args, kwargs)
+        future.rawlink(self.done)
+        return future
+
+    def timed(self, name, fn, args, kwargs):
+        """Calls the function and records its latency. Runs on the I/O
+        thread."""
+        start = self.clock.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.stats[name].record(self.clock.time() - start)
+
+    def done(self, future):
+        """Called in the hub when a call finishes."""
+        self.depth -= 1
+
+    def report(self):
+        """Returns a summary of the queue depth and the latency of each Myro
+        function that has been called."""
+        parts = ["io queue: {}".format(self.depth)]
+        for name in sorted(self.stats):
+            s = self.stats[name]
+            parts.append("{}: {} calls, mean {:.1f} ms, max {:.1f} ms".format(
+                name, s.count, 1000 * s.mean, 1000 * s.max))
+        return "; ".join(parts)
+
+    def __getattr__(self, name):
+        """Returns a version of the named Myro function that runs on the I/O
+        thread, blocking only the calling greenlet."""
+        attr = getattr(self.myro, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            return self.submit(name, *args, **kwargs).get()
+        return call
@@ -0,0 +1,86 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Keeps track of the robots that the server controls."""
+
+import sys
+from collections import OrderedDict
+
+from scribbler.controller import Controller
+from scribbler.motors import Motors
+from scribbler.robotio import RobotIO
+from scribbler.sensors import SAMPLE_PERIODS, Sensors
+from scribbler.timing import Clock
+
+
+class Robot(object):
+
+    """One Scribbler and everything needed to control it.
+
+    Each robot has its own serial connection with its own I/O thread, its own
+    sensor sampling, and its own controller, which runs its own program (with
+    its own parameters) and publishes to its own hub. Programs reach the robot
+    through the `myro` attribute, which has the motor commands coalesced and
+    the sensor readings cached.
+    """
+
+    def __init__(self, robot_id, device, periods=SAMPLE_PERIODS, clock=None):
+        """Creates a robot with the given ID that is controlled through
+        `device`, an object with Myro's robot functions (see `connect`). The
+        sensors in `periods` are sampled in the background."""
+        self.id = robot_id
+        self.clock = clock or Clock()
+        self.io = RobotIO(device)
+        self.sensors = Sensors(self.io, periods, self.clock, self.report_error)
+        self.myro = Motors(self.sensors, self.report_error)
+        self.controller = Controller(self)
+
+    def report_error(self, message):
+        """Reports an error from the robot's background I/O, which has no
+        caller to raise it to, on stderr and as a status to the clients."""
+        message = "error: robot {}: {}".format(self.id, message)
+        sys.stderr.write(message + "\n")
+        self.controller.publish('status', message)
+
+
+class Registry(object):
+
+    """The robots that the server controls, by ID, in the order they were
+    added. The first robot is the default one."""
+
+    def __init__(self):
+        """Creates an empty registry."""
+        self.robots = OrderedDict()
+
+    def add(self, robot):
+        """Adds a robot to the registry."""
+        if robot.id in self.robots:
+            raise ValueError("duplicate robot ID '{}'".format(robot.id))
+        self.robots[robot.id] = robot
+
+    def get(self, robot_id=None):
+        """Returns the robot with the given ID (or the default robot if the ID
+        is None or empty). Returns None if there is no such robot."""
+        if not robot_id:
+            return next(iter(self.robots.values()), None)
+        return self.robots.get(robot_id)
+
+    def ids(self):
+        """Returns the list of robot IDs."""
+        return list(self.robots)
+
+    def stop(self):
+        """Stops the programs on all the robots."""
+        for robot in self.robots.values():
+            robot.controller.stop()
+
+
+def connect(backend, port):
+    """Connects to the robot on the given serial port using `backend`, which is
+    the Myro module or a module like it. Myro only supports one robot through
+    its module-level functions, so a robot object is created for each port if
+    the backend provides a `Scribbler` class. Returns the object to use for the
+    robot's Myro functions."""
+    if hasattr(backend, 'Scribbler'):
+        return backend.Scribbler(port)
+    backend.initialize(port)
+    return backend
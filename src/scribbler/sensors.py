@@ -0,0 +1,126 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Samples the robot's sensors in the background and caches the readings."""
+
+from collections import deque
+
+import gevent
+from gevent.event import Event
+
+from scribbler.timing import Clock
+from scribbler.util import median
+
+
+# Myro functions that read each sensor.
+SENSORS = {
+    'obstacle': 'getObstacle',
+    'battery': 'getBattery'
+}
+
+# Default time between background samples of each sensor (seconds). Sensors
+# that are not listed are only read on demand.
+SAMPLE_PERIODS = {
+    'obstacle': 0.02
+}
+
+# Number of recent samples remembered for each sensor.
+HISTORY_SIZE = 16
+
+# The background sampling pauses when no program has asked for a reading in
+# this long, so that an idle robot doesn't keep the serial link busy (seconds).
+IDLE_TIMEOUT = 1.0
+
+
+class Sensors(object):
+
+    """Wraps a Myro-like module to cache and filter sensor readings.
+
+    A greenlet samples each sensor in `SAMPLE_PERIODS` at a fixed rate, and
+    every reading is kept in a short timestamped history. Programs ask for the
+    latest value no older than some age, which usually costs no serial
+    transaction at all. Other attributes are passed through to the wrapped
+    module. When background samples start failing, the error is passed to
+    `on_error` (if given) as a message, and the sampling carries on.
+    """
+
+    def __init__(self, myro, periods=SAMPLE_PERIODS, clock=None,
+                 on_error=None):
+        """Wraps the given Myro module and starts sampling the sensors in
+        `periods` (a dictionary from sensor names to seconds). The `on_error`
+        function is called with a message when a background sample fails."""
+        self.myro = myro
+        self.on_error = on_error
+        self.clock = clock or Clock()
+        self.history = dict((name, deque(maxlen=HISTORY_SIZE))
+                            for name in SENSORS)
+        self.last_request = None
+        self.requested = Event()
+        self.failed = 0
+        self.samplers = [gevent.spawn(self.sample_loop, name, period)
+                         for name, period in periods.items()]
+
+    def sample(self, name):
+        """Reads the sensor now, records the reading, and returns it."""
+        value = getattr(self.myro, SENSORS[name])()
+        self.history[name].append((self.clock.time(), value))
+        return value
+
+    def sample_loop(self, name, period):
+        """Samples the sensor every `period` seconds for as long as programs
+        keep asking for readings. Runs forever, even when a reading fails."""
+        failing = False
+        while True:
+            idle = self.last_request is None or (
+                self.clock.time() - self.last_request > IDLE_TIMEOUT)
+            if idle:
+                self.requested.clear()
+                self.requested.wait()
+            try:
+                self.sample(name)
+                failing = False
+            except Exception as e:
+                self.failed += 1
+                # Only report the first of a run of failures, so that a
+                # disconnected robot doesn't flood the clients.
+                if self.on_error and not failing:
+                    self.on_error("{} sensor failed: {}".format(name, e))
+                failing = True
+            gevent.sleep(period)
+
+    def recent(self, name, max_age):
+        """Returns the list of readings of the sensor that are no older than
+        `max_age` seconds, from newest to oldest."""
+        self.last_request = self.clock.time()
+        self.requested.set()
+        oldest = self.last_request - max_age
+        values = []
+        for t, value in reversed(self.history[name]):
+            if t < oldest:
+                break
+            values.append(value)
+        return values
+
+    def read(self, name, max_age=0):
+        """Returns the latest reading of the sensor if it is no older than
+        `max_age` seconds. Otherwise, reads the sensor now."""
+        values = self.recent(name, max_age)
+        if values:
+            return values[0]
+        return self.sample(name)
+
+    def median(self, name, k, max_age=0):
+        """Returns the median of the last `k` readings of the sensor that are no
+        older than `max_age` seconds, reading the sensor now if there are none.
+        For sensors that return lists (like the three obstacle sensors), the
+        median is taken separately for each element."""
+        values = self.recent(name, max_age)[:max(1, int(k))]
+        if not values:
+            values = [self.sample(name)]
+        if isinstance(values[0], (list, tuple)):
+            return [median(column) for column in zip(*values)]
+        return median(values)
+
+    def __getattr__(self, name):
+        """Passes other attributes through to the wrapped module."""
+        return getattr(self.myro, name)
+
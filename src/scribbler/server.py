@@ -3,47 +3,106 @@
 """Implements the server for the web application."""
 
 import gevent
+import json
 import os.path
 import webbrowser
 from datetime import datetime
 from gevent import pywsgi
+from gevent.pool import Pool
 from sys import exit
+from urlparse import parse_qs
 
-from scribbler.controller import Controller
+from scribbler.assets import IDENTITY, AssetCache
+from scribbler.connections import POOL_SIZE, ConnectionStats, Handler
+from scribbler.metrics import Timer, compact, histogram_for, prometheus
+from scribbler.protocol import ProtocolError, decode_batch, encode_error
+from scribbler.protocol import encode_replies, parse, text_reply
 
 
 # Response statuses.
 STATUS_200 = '200 OK'
 STATUS_204 = '204 NO CONTENT'
+STATUS_304 = '304 NOT MODIFIED'
+STATUS_400 = '400 BAD REQUEST'
 STATUS_404 = '404 NOT FOUND'
+STATUS_503 = '503 SERVICE UNAVAILABLE'
 
 # MIME types for file extensions.
 MIME_PLAIN = 'text/plain'
+MIME_JSON = 'application/json'
+MIME_PROMETHEUS = 'text/plain; version=0.0.4'
 MIMES = {'html': 'text/html', 'css': 'text/css', 'js': 'application/javascript'}
 
 # Convential paths for important files.
 PATH_INDEX = '/index.html'
 PATH_404 = '/404.html'
 
+# Path of the Server-Sent Events stream of status messages.
+PATH_EVENTS = '/events'
+
+# Path of the latency metrics. They are in the Prometheus text format unless the
+# query string asks for JSON.
+PATH_METRICS = '/metrics'
+FORMAT_PARAM = 'format'
+
+# How often to send a comment on an idle event stream, so that proxies and the
+# browser don't consider the connection dead (seconds).
+STREAM_KEEPALIVE = 15
+
+# How long the browser should wait before reconnecting a broken stream (ms).
+STREAM_RETRY = 2000
+
+# Query string parameter that selects the robot a request is for. Requests
+# without it go to the first robot.
+ROBOT_PARAM = 'robot'
+
+# The command that lists the IDs of the robots, which the server answers itself.
+ROBOTS_COMMAND = 'short:robots'
+
+# The command that reports the connection statistics, which the server also
+# answers itself.
+CONNECTIONS_COMMAND = 'short:connections'
+
+# The command that summarizes the latency metrics in the compact JSON form.
+METRICS_COMMAND = 'short:metrics'
+
+# Commands that wait for status messages, which count as long-polls.
+LONG_POLL_COMMANDS = ['long:status']
+
+# How long a client should wait before retrying a long-poll or event stream
+# that was refused because there were too many (seconds).
+LONG_POLL_RETRY = 1
+
+# Clients may cache static resources, but they must revalidate them with the
+# ETag on every use so that regenerated templates show up immediately.
+CACHE_CONTROL = 'no-cache'
+
 
 class Server(object):
 
     """A very simple web server."""
 
-    def __init__(self, host, port, root, whitelist):
-        """Create a server that serves from root on host:port.
+    def __init__(self, host, port, root, whitelist, registry):
+        """Create a server that serves from root on host:port and controls the
+        robots in the registry.
 
         Only paths in the root directory that are also present in the whitelist
         will be served. The whitelist paths are absolute, so they must begin
         with a slash. The paths '/', '/index.html', and '/404.html' must be
         included for the website to work properly.
         """
-        self.httpd = pywsgi.WSGIServer((host, port), self.handle_request)
+        self.stats = ConnectionStats()
+        self.httpd = pywsgi.WSGIServer((host, port), self.handle_request,
+                                       spawn=Pool(POOL_SIZE),
+                                       handler_class=Handler)
+        self.httpd.stats = self.stats
+        self.http_stats = {}
         self.url = "http://{}:{}".format(host, port)
         self.root = root.rstrip('/')
         self.whitelist = whitelist
+        self.assets = AssetCache(self.root, [p for p in whitelist if p != '/'])
         self.running = False
-        self.controller = Controller()
+        self.registry = registry
 
     def start(self, open_browser=True, verbose=True):
         """Starts the server if it is not already running. Unless False
@@ -61,7 +120,7 @@ class Server(object):
     def stop(self):
         """Stops the program and the server. Does nothing if already stopped."""
         if self.running:
-            self.controller.stop()
+            self.registry.stop()
             self.httpd.stop()
 
     def stay_alive(self):
@@ -74,23 +133,154 @@ class Server(object):
             exit()
 
     def handle_request(self, env, start_response):
-        """Handles all server requests."""
+        """Handles all server requests. The time they take is recorded for
+        each kind of request, except for event streams, which never end."""
         method = env['REQUEST_METHOD']
+        path = env['PATH_INFO']
+        if method == 'GET' and path == PATH_METRICS:
+            with self.timer('metrics'):
+                return self.handle_metrics(env, start_response)
+        if method == 'GET' and path != PATH_EVENTS:
+            with self.timer('static'):
+                return self.handle_get(env, start_response)
+        robot = self.robot(env)
+        if robot is None:
+            msg = "unknown robot"
+            start_response(STATUS_404, headers(get_mime(), len(msg)))
+            return [msg]
         if method == 'GET':
-            return self.handle_get(env['PATH_INFO'], start_response)
+            if not self.stats.start_long_poll():
+                return refuse(start_response)
+            return self.handle_stream(env, start_response, robot.controller)
         elif method == 'POST':
-            return self.handle_post(extract_data(env), start_response)
-
-    def handle_get(self, path_info, start_response):
-        """Handles a GET request, which is used for getting resources."""
-        path = self.path(path_info)
-        head = headers(get_mime(path), os.path.getsize(path))
-        start_response(get_status(path), head)
-        return open(path)
-
-    def handle_post(self, data, start_response):
-        """Handles a POST request, which is used for AJAX communication."""
-        msg = self.controller(data)
+            data = extract_data(env)
+            if not is_long_poll(data):
+                with self.timer('command'):
+                    return self.handle_post(data, start_response,
+                                            robot.controller)
+            if not self.stats.start_long_poll():
+                return refuse(start_response)
+            try:
+                with self.timer('long-poll'):
+                    return self.handle_post(data, start_response,
+                                            robot.controller)
+            finally:
+                self.stats.end_long_poll()
+
+    def timer(self, kind):
+        """Returns a Timer for recording how long a kind of request takes."""
+        return Timer(histogram_for(self.http_stats, kind))
+
+    def robot(self, env):
+        """Returns the robot that the request is for, or None if the request
+        names a robot that doesn't exist."""
+        query = parse_qs(env.get('QUERY_STRING', ''))
+        robot_id = query.get(ROBOT_PARAM, [None])[0]
+        return self.registry.get(robot_id)
+
+    def handle_get(self, env, start_response):
+        """Handles a GET request, which is used for getting resources. They are
+        served from memory, and clients with a current copy get a 304."""
+        path = self.path(env['PATH_INFO'])
+        asset = self.assets.get(path)
+        status = get_status(path)
+        coding, data, etag = asset.variant(env)
+        if status == STATUS_200 and asset.is_fresh(env, etag):
+            start_response(STATUS_304, cache_headers(asset, etag))
+            return []
+        head = headers(get_mime(path), len(data))
+        if coding != IDENTITY:
+            head.append(('Content-Encoding', coding))
+        if status == STATUS_200:
+            head += cache_headers(asset, etag)
+        elif asset.compressible:
+            head.append(('Vary', 'Accept-Encoding'))
+        start_response(status, head)
+        return [data]
+
+    def handle_metrics(self, env, start_response):
+        """Handles a request for the latency metrics, which are in the
+        Prometheus text format, or in the compact JSON form if the query string
+        has 'format=json'."""
+        query = parse_qs(env.get('QUERY_STRING', ''))
+        series = self.metric_series()
+        if query.get(FORMAT_PARAM, [None])[0] == 'json':
+            body = json.dumps(compact(series))
+            mime = MIME_JSON
+        else:
+            body = prometheus(series)
+            mime = MIME_PROMETHEUS
+        start_response(STATUS_200, headers(mime, len(body)))
+        return [body]
+
+    def metric_series(self):
+        """Returns the series of latency histograms of the server and all the
+        robots (see `metrics.prometheus`)."""
+        series = [('http_seconds', [('kind', kind)], h)
+                  for kind, h in self.http_stats.items()]
+        for robot in self.registry.robots.values():
+            label = ('robot', robot.id)
+            controller = robot.controller
+            series += [('command_seconds', [label, ('command', name)], h)
+                       for name, h in controller.command_stats.items()]
+            series += [('loop_seconds', [label, ('program', name)], h)
+                       for name, h in controller.loop_stats.items()]
+            series += [('myro_seconds', [label, ('call', name)], h)
+                       for name, h in robot.io.stats.items()]
+        return series
+
+    def handle_stream(self, env, start_response, controller):
+        """Handles a request for the event stream of a robot. The response never
+        ends; it pushes every message the robot's controller publishes to the
+        client. A client that reconnects resumes after the last event ID it
+        received."""
+        head = [('Content-Type', 'text/event-stream'),
+                ('Cache-Control', 'no-cache')]
+        start_response(STATUS_200, head)
+        hub = controller.hub
+        try:
+            cursor = int(env.get('HTTP_LAST_EVENT_ID', ''))
+        except ValueError:
+            cursor = hub.seq
+        if cursor > hub.seq:
+            cursor = 0
+        return self.stream_events(hub, cursor)
+
+    def stream_events(self, hub, cursor):
+        """Yields the Server-Sent Events for messages published after the
+        cursor. If the client falls so far behind that messages are lost, the
+        stream is cut off; when the browser reconnects, it gets a notice about
+        the lost messages and continues from the oldest one available. The
+        stream counts as a long-poll until it ends."""
+        try:
+            yield "retry: {}\n\n".format(STREAM_RETRY)
+            resuming = True
+            while True:
+                missed, messages = hub.wait(cursor, STREAM_KEEPALIVE)
+                if missed:
+                    if not resuming:
+                        return
+                    notice = "missed {} messages".format(missed)
+                    yield format_event('status', notice)
+                resuming = False
+                if not messages:
+                    yield ": keep-alive\n\n"
+                    continue
+                cursor = messages[-1][0]
+                yield ''.join(format_event(e, d, seq)
+                              for seq, e, d in messages)
+        finally:
+            self.stats.end_long_poll()
+
+    def handle_post(self, data, start_response, controller):
+        """Handles a POST request, which is used for AJAX communication. A JSON
+        object is a batch of requests in the structured protocol, and anything
+        else is a single plain-text command. Commands are passed to the robot's
+        controller."""
+        if data.startswith('{'):
+            return self.handle_batch(data, start_response, controller)
+        request = parse(data)
+        msg = text_reply(request.name, self.dispatch(request, controller))
         if msg == None:
             head = headers(get_mime(), 0)
             start_response(STATUS_204, head)
@@ -99,16 +289,69 @@ class Server(object):
         start_response(get_status(), head)
         return [msg]
 
+    def handle_batch(self, data, start_response, controller):
+        """Handles a batch of requests, performing them in order and replying
+        with all their results at once (see `protocol.encode_replies`). A
+        request that fails doesn't stop the ones after it."""
+        try:
+            requests = decode_batch(data)
+        except ProtocolError as e:
+            body = encode_error(str(e))
+            start_response(STATUS_400, headers(MIME_JSON, len(body)))
+            return [body]
+        replies = []
+        for request in requests:
+            try:
+                replies.append((True, self.dispatch(request, controller)))
+            except Exception as e:
+                replies.append((False, "{}: {}".format(request.name, e)))
+        body = encode_replies(replies)
+        start_response(STATUS_200, headers(MIME_JSON, len(body)))
+        return [body]
+
+    def dispatch(self, request, controller):
+        """Performs a request and returns the reply. The server answers the
+        commands that list the robots and report the connections and the
+        metrics itself."""
+        if request.name == ROBOTS_COMMAND:
+            return self.registry.ids()
+        if request.name == CONNECTIONS_COMMAND:
+            return self.stats.report()
+        if request.name == METRICS_COMMAND:
+            return compact(self.metric_series())
+        return controller.handle(request)
+
     def path(self, path_info):
-        """Returns the relative path that should be followed for the request.
-        The root will go to index file. Anything not present in the server's
-        whitelist will cause a 404."""
+        """Returns the path (relative to the root) that should be served for the
+        request. The root will go to index file. Anything not present in the
+        server's whitelist will cause a 404."""
         if path_info in self.whitelist:
             if path_info == '/':
                 path_info = PATH_INDEX
         else:
             path_info = PATH_404
-        return self.root + path_info
+        return path_info
+
+
+def is_long_poll(data):
+    """Returns true if the POST data contains a command that waits for status
+    messages, either on its own or in a batch."""
+    if data.startswith('{'):
+        try:
+            return any(r.name in LONG_POLL_COMMANDS for r in decode_batch(data))
+        except ProtocolError:
+            return False
+    return parse(data).name in LONG_POLL_COMMANDS
+
+
+def refuse(start_response):
+    """Responds that there are too many long-polls, and that the client should
+    try again later."""
+    msg = "too many long-polls"
+    head = headers(get_mime(), len(msg))
+    head.append(('Retry-After', str(LONG_POLL_RETRY)))
+    start_response(STATUS_503, head)
+    return [msg]
 
 
 def get_status(path=None):
@@ -136,6 +379,28 @@ def headers(mime, length):
             ('Content-Length', str(length))]
 
 
+def cache_headers(asset, etag):
+    """Returns a list of HTTP headers that allow the client to cache the asset
+    (the variant with the given ETag) and revalidate it later with a
+    conditional request."""
+    headers = [('ETag', etag),
+               ('Last-Modified', asset.last_modified),
+               ('Cache-Control', CACHE_CONTROL)]
+    if asset.compressible:
+        headers.append(('Vary', 'Accept-Encoding'))
+    return headers
+
+
+def format_event(event, data, seq=None):
+    """Formats an event for a text/event-stream response. The sequence number
+    becomes the event ID, which the browser sends back when it reconnects."""
+    lines = ["event: " + event]
+    if seq is not None:
+        lines.append("id: {}".format(seq))
+    lines += ["data: " + line for line in str(data).split('\n')]
+    return '\n'.join(lines) + '\n\n'
+
+
 def extract_data(env):
     """Extracts the data from the envment of a POST request."""
     try:
@@ -0,0 +1,210 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Runs programs against simulated robots and measures how well they did."""
+
+import json
+import math
+import multiprocessing
+import os
+from time import time
+
+from scribbler.controller import DEFAULT_PROGRAM, Controller
+from scribbler.sensors import Sensors
+from scribbler.simulator import SimRobot, load_scene, point_segment_dist
+from scribbler.timing import VirtualClock
+
+
+# Longest a scenario is run for when it doesn't give a limit (virtual seconds).
+DEFAULT_LIMIT = 300
+
+# Number of scenarios handed to a worker process at a time.
+CHUNK_SIZE = 4
+
+
+class SimulatedRobot(object):
+
+    """A robot that exists only in a simulation on a virtual clock.
+
+    It has the same attributes as a `Robot`, so programs and controllers can't
+    tell the difference. Motor commands and sensor reads go straight to the
+    simulation, without an I/O thread or a writer greenlet in between, since
+    those are only there to hide the latency of the serial link.
+    """
+
+    def __init__(self, robot_id, scene=None, program_id=DEFAULT_PROGRAM):
+        """Creates a robot in the given scene (see `load_scene`) running the
+        given program."""
+        self.id = robot_id
+        self.clock = VirtualClock()
+        self.sim = SimRobot(scene, self.clock)
+        self.myro = Sensors(self.sim, {}, self.clock)
+        self.controller = Controller(self, program_id)
+
+
+def load_scenarios(path):
+    """Loads a list of scenarios from a JSON file. Scenes given as file names
+    are loaded relative to the file's directory. Each scenario is an object
+    which may contain:
+
+    name     -- a name to identify the scenario's results
+    program  -- the ID of the program to run (the default program otherwise)
+    scene    -- a scene (see `load_scene`), or the name of a scene file
+    commands -- a list of commands sent to the program before it starts
+    drawing  -- points (as `[x, y]` pairs in pixels) for Tracie to draw, which
+                are also the intended shape of the pen path
+    target   -- the intended shape of the pen path (as `[x, y]` pairs in
+                centimetres, in the scene's coordinates)
+    limit    -- how long the program is allowed to run (virtual seconds)
+    """
+    with open(path) as f:
+        scenarios = json.load(f)
+    base = os.path.dirname(path)
+    for scenario in scenarios:
+        scene = scenario.get('scene')
+        if isinstance(scene, basestring):
+            scenario['scene'] = load_scene(os.path.join(base, scene))
+    return scenarios
+
+
+def repeat(scenarios, n):
+    """Returns a list with each scenario repeated n times, each time with a
+    different seed for the noise in its scene."""
+    if n <= 1:
+        return list(scenarios)
+    repeated = []
+    for scenario in scenarios:
+        scene = scenario.get('scene') or {}
+        for i in range(n):
+            copy = dict(scenario)
+            copy['scene'] = dict(scene, seed=scene.get('seed', 0) + i)
+            copy['name'] = "{}#{}".format(scenario.get('name', ''), i)
+            repeated.append(copy)
+    return repeated
+
+
+def run(scenario):
+    """Runs one scenario to completion (or until its time limit) and returns a
+    dictionary of metrics:
+
+    name          -- the scenario's name
+    completed     -- whether the program finished before the time limit
+    time          -- how long the program ran (virtual seconds)
+    path_error    -- mean distance from the pen path to the intended shape
+    max_error     -- largest distance between the pen path and the intended
+                     shape, in either direction (the Hausdorff distance)
+    mode_switches -- number of times the program changed modes
+    collisions    -- number of times the robot ran into an obstacle
+    distance      -- distance driven (centimetres)
+    commands      -- number of motor commands sent
+    wall_time     -- how long the simulation took (real seconds)
+    error         -- the reason the program couldn't start, if it couldn't
+
+    The errors are None when the scenario has no intended shape.
+    """
+    began = time()
+    scene = scenario.get('scene') or {}
+    program_id = scenario.get('program', DEFAULT_PROGRAM)
+    robot = SimulatedRobot(scenario.get('name'), scene, program_id)
+    controller = robot.controller
+    commands = list(scenario.get('commands', []))
+    drawing = scenario.get('drawing')
+    if drawing:
+        points = [{'x': x, 'y': y} for x, y in drawing]
+        commands.append('points:' + json.dumps(points))
+    for command in commands:
+        controller(command)
+    program = controller.program
+    result = {
+        'name': scenario.get('name'),
+        'completed': False,
+        'time': 0.0,
+        'path_error': None,
+        'max_error': None,
+        'mode_switches': 0,
+        'collisions': 0,
+        'distance': 0.0,
+        'commands': 0,
+        'wall_time': 0.0,
+        'error': program.no_start() or None
+    }
+    if result['error']:
+        return result
+    limit = scenario.get('limit', DEFAULT_LIMIT)
+    clock = robot.clock
+    program.start()
+    controller.publish_events()
+    modes = [getattr(program, 'mode', None)]
+
+    def count_switches():
+        mode = getattr(program, 'mode', None)
+        if mode != modes[-1]:
+            result['mode_switches'] += 1
+            modes.append(mode)
+
+    result['completed'] = controller.main_loop(limit, count_switches)
+    program.stop()
+    sim = robot.sim
+    target = scenario.get('target')
+    if drawing and not target:
+        target = drawing_target(drawing, program.params['point_scale'], scene)
+    if target:
+        mean, worst = path_error(sim.pen_path(), target)
+        result['path_error'] = mean
+        result['max_error'] = worst
+    result['time'] = clock.time()
+    result['collisions'] = sim.bumps
+    result['distance'] = sim.distance
+    result['commands'] = sim.commands
+    result['wall_time'] = time() - began
+    return result
+
+
+def safe_run(scenario):
+    """Runs the scenario like `run`, but returns the exception as the error
+    instead of raising it, so that one bad scenario doesn't end the batch."""
+    try:
+        return run(scenario)
+    except Exception as e:
+        return {'name': scenario.get('name'), 'error': repr(e)}
+
+
+def run_batch(scenarios, processes=None):
+    """Runs the scenarios in parallel on a pool of worker processes (one per
+    CPU by default). Yields the results in the same order as the
+    scenarios."""
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(safe_run, scenarios, CHUNK_SIZE):
+            yield result
+    finally:
+        pool.terminate()
+
+
+def drawing_target(drawing, scale, scene):
+    """Returns the shape that Tracie should draw for the points, in the scene's
+    coordinates. Tracie starts at the first point facing up the drawing's y
+    axis, which is wherever the robot faces at the start of the scene."""
+    x0, y0, heading = scene.get('start', [0, 0, 90])
+    turn = math.radians(heading) - math.pi / 2
+    cos, sin = math.cos(turn), math.sin(turn)
+    first_x, first_y = drawing[0]
+    target = []
+    for x, y in drawing:
+        dx = scale * (x - first_x)
+        dy = scale * (y - first_y)
+        target.append((x0 + dx * cos - dy * sin, y0 + dx * sin + dy * cos))
+    return target
+
+
+def path_error(path, target):
+    """Compares a path with the intended shape (both lists of points). Returns
+    the mean distance from the points of the path to the shape, and the
+    Hausdorff distance between them."""
+    segments = zip(target, target[1:]) or [(target[0], target[0])]
+    to_target = [min(point_segment_dist(p, a, b) for a, b in segments)
+                 for p in path]
+    path_segments = zip(path, path[1:]) or [(path[0], path[0])]
+    to_path = [min(point_segment_dist(p, a, b) for a, b in path_segments)
+               for p in target]
+    mean = sum(to_target) / len(to_target)
+    return mean, max(to_target + to_path)
@@ -0,0 +1,297 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Simulates a Scribbler so that programs can run without the robot."""
+
+import json
+import math
+import random
+
+from scribbler.timing import Clock
+
+
+# Speed of each wheel at full power (cm/s). This matches the default
+# `dist_to_time` parameter of 0.07 s/cm.
+WHEEL_SPEED = 1 / 0.07
+
+# Distance between the wheels (cm). With the wheel speed, this makes the robot
+# pivot at 111 deg/s at full power, which matches the default `angle_to_time`
+# parameter of 0.009 s/deg. The real robot pivots relatively faster at low
+# power, so Tracie's calibration (0.0052 s/deg at 0.1) doesn't hold here, and
+# scenarios for Tracie set `att` to 0.009.
+WHEEL_BASE = 14.7
+
+# Radius of the robot's body, which is used for detecting collisions (cm).
+ROBOT_RADIUS = 8.0
+
+# Directions of the left, center, and right IR obstacle sensors relative to the
+# robot's heading (radians).
+SENSOR_ANGLES = [0.3, 0.0, -0.3]
+
+# Largest distance from the front of the robot at which the IR sensors see an
+# obstacle (cm), and the reading for an obstacle right in front of them.
+IR_RANGE = 20.0
+IR_MAX = 6400
+
+# The simulation advances in steps of at most this long (seconds).
+SIM_STEP = 0.01
+
+# A new point is added to the pen path when the robot has moved this far from
+# the last one (cm).
+PEN_RESOLUTION = 0.2
+
+# The battery voltage that the simulated robot reports.
+BATTERY = 7.5
+
+
+class SimRobot(object):
+
+    """A simulated Scribbler with the same functions as a Myro robot.
+
+    Motor commands set the speeds of the two wheels, and the robot's position
+    and heading are integrated with differential-drive kinematics whenever it
+    is asked for something, up to the current time on its clock. Using a
+    VirtualClock makes the simulation deterministic and lets it run much faster
+    than real time. The IR sensors are simulated by casting rays at the
+    obstacles of the scene, and the path of the pen (at the robot's center) is
+    recorded. Positions are in centimetres, and headings are in radians in
+    standard position.
+    """
+
+    def __init__(self, scene=None, clock=None):
+        """Creates a robot in the given scene (a dictionary like the ones
+        returned by `load_scene`), which measures time with the clock."""
+        scene = scene or {}
+        self.clock = clock or Clock()
+        x, y, heading = scene.get('start', [0, 0, 90])
+        self.x = float(x)
+        self.y = float(y)
+        self.heading = math.radians(heading)
+        self.segments, self.circles = scene_shapes(scene.get('obstacles', []))
+        self.noise = scene.get('noise', 0.0)
+        self.random = random.Random(scene.get('seed', 0))
+        self.left = 0.0
+        self.right = 0.0
+        self.time = self.clock.time()
+        self.pen = [(self.x, self.y)]
+        self.distance = 0.0
+        self.bumps = 0
+        self.touching = False
+        self.commands = 0
+
+    def initialize(self, port):
+        """Does nothing, since there is no robot to connect to."""
+        pass
+
+    def motors(self, left, right):
+        """Sets the power of the left and right wheels (from -1 to 1)."""
+        self.update()
+        self.left = clamp(left) * self.slip()
+        self.right = clamp(right) * self.slip()
+        self.commands += 1
+
+    def forward(self, speed):
+        """Drives forward at the given speed."""
+        self.motors(speed, speed)
+
+    def backward(self, speed):
+        """Drives backward at the given speed."""
+        self.motors(-speed, -speed)
+
+    def rotate(self, speed):
+        """Pivots at the given speed (positive is counterclockwise)."""
+        self.motors(-speed, speed)
+
+    def move(self, translate, rotate):
+        """Drives and turns at the same time."""
+        self.motors(translate - rotate, translate + rotate)
+
+    def stop(self):
+        """Stops the motors."""
+        self.motors(0, 0)
+
+    def beep(self, length, freq):
+        """Does nothing, since the simulation is silent."""
+        pass
+
+    def getBattery(self):
+        """Returns the battery voltage."""
+        return BATTERY
+
+    def getObstacle(self):
+        """Returns the readings of the left, center, and right IR sensors. They
+        are zero when nothing is in range and grow to `IR_MAX` as the obstacle
+        gets closer."""
+        self.update()
+        readings = []
+        for angle in SENSOR_ANGLES:
+            d = self.cast(self.heading + angle)
+            if d is None or d > IR_RANGE:
+                readings.append(0)
+            else:
+                readings.append(int(IR_MAX * (1 - d / IR_RANGE) ** 2))
+        return readings
+
+    def slip(self):
+        """Returns the random factor by which a wheel's speed differs from the
+        commanded speed, which is always 1 when there is no noise."""
+        if not self.noise:
+            return 1.0
+        return 1.0 + self.random.gauss(0, self.noise)
+
+    def update(self):
+        """Advances the simulation to the current time."""
+        now = self.clock.time()
+        while self.time < now:
+            dt = min(SIM_STEP, now - self.time)
+            self.step(dt)
+            self.time += dt
+
+    def step(self, dt):
+        """Moves the robot according to the wheel speeds for `dt` seconds. The
+        robot doesn't move if it would run into an obstacle."""
+        v = WHEEL_SPEED * (self.left + self.right) / 2
+        w = WHEEL_SPEED * (self.right - self.left) / WHEEL_BASE
+        if v == 0 and w == 0:
+            return
+        # Move exactly along the arc, by its chord. The chord points halfway
+        # between the old and new headings, and it is shorter than the arc by
+        # a factor of sin(h) / h. Unlike subtracting sines of the headings,
+        # this stays accurate when the arc is almost straight.
+        half = w * dt / 2
+        chord = v * dt
+        if half != 0:
+            chord *= math.sin(half) / half
+        theta = self.heading + w * dt
+        x = self.x + chord * math.cos(self.heading + half)
+        y = self.y + chord * math.sin(self.heading + half)
+        if v != 0 and self.collides(x, y):
+            if not self.touching:
+                self.bumps += 1
+            self.touching = True
+            return
+        self.touching = False
+        self.distance += abs(v) * dt
+        self.x, self.y, self.heading = x, y, theta
+        px, py = self.pen[-1]
+        if math.hypot(x - px, y - py) >= PEN_RESOLUTION:
+            self.pen.append((x, y))
+
+    def collides(self, x, y):
+        """Returns true if the robot's body would overlap an obstacle with its
+        center at (x,y)."""
+        for a, b in self.segments:
+            if point_segment_dist((x, y), a, b) < ROBOT_RADIUS:
+                return True
+        for cx, cy, r in self.circles:
+            if math.hypot(x - cx, y - cy) < ROBOT_RADIUS + r:
+                return True
+        return False
+
+    def cast(self, angle):
+        """Returns the distance from the front of the robot to the nearest
+        obstacle in the given direction, or None if there is none."""
+        dx, dy = math.cos(angle), math.sin(angle)
+        ox = self.x + ROBOT_RADIUS * math.cos(self.heading)
+        oy = self.y + ROBOT_RADIUS * math.sin(self.heading)
+        best = None
+        for a, b in self.segments:
+            d = ray_segment((ox, oy), (dx, dy), a, b)
+            if d is not None and (best is None or d < best):
+                best = d
+        for cx, cy, r in self.circles:
+            d = ray_circle((ox, oy), (dx, dy), (cx, cy), r)
+            if d is not None and (best is None or d < best):
+                best = d
+        return best
+
+    def pose(self):
+        """Returns the robot's current position and heading."""
+        self.update()
+        return self.x, self.y, self.heading
+
+    def pen_path(self):
+        """Returns the list of points that the pen has drawn through."""
+        self.update()
+        return self.pen + [(self.x, self.y)]
+
+
+def load_scene(path):
+    """Loads a scene from a JSON file. The file has an object which may contain
+    'start' (the robot's starting x, y, and heading in degrees), 'obstacles' (a
+    list of objects, each one a 'wall' from 'a' to 'b', a 'box' with a corner
+    at 'x', 'y' and a 'width' and 'height', or a 'circle' at 'x', 'y' with a
+    'radius'), 'noise' (the standard deviation of the relative error in wheel
+    speeds), and 'seed' (for the random noise)."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def scene_shapes(obstacles):
+    """Converts the obstacles of a scene into a list of line segments and a
+    list of circles `(x, y, radius)`."""
+    segments = []
+    circles = []
+    for ob in obstacles:
+        kind = ob['type']
+        if kind == 'wall':
+            segments.append((tuple(ob['a']), tuple(ob['b'])))
+        elif kind == 'box':
+            x, y = ob['x'], ob['y']
+            w, h = ob['width'], ob['height']
+            corners = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+            segments += zip(corners, corners[1:] + corners[:1])
+        elif kind == 'circle':
+            circles.append((ob['x'], ob['y'], ob['radius']))
+        else:
+            raise ValueError("unknown obstacle type '{}'".format(kind))
+    return segments, circles
+
+
+def clamp(power):
+    """Limits a motor power to the range from -1 to 1."""
+    return max(-1.0, min(1.0, float(power)))
+
+
+def point_segment_dist(p, a, b):
+    """Returns the distance from point `p` to the line segment from `a` to
+    `b`."""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length_2 = dx * dx + dy * dy
+    t = 0.0
+    if length_2 > 0:
+        t = ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / length_2
+        t = max(0.0, min(1.0, t))
+    return math.hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy)
+
+
+def ray_segment(origin, direction, a, b):
+    """Returns the distance along the ray (with a unit direction) to where it
+    crosses the line segment from `a` to `b`, or None if it doesn't."""
+    ex, ey = b[0] - a[0], b[1] - a[1]
+    dx, dy = direction
+    denom = dx * ey - dy * ex
+    if denom == 0:
+        return None
+    qx, qy = a[0] - origin[0], a[1] - origin[1]
+    t = (qx * ey - qy * ex) / denom
+    u = (qx * dy - qy * dx) / denom
+    if t >= 0 and 0 <= u <= 1:
+        return t
+    return None
+
+
+def ray_circle(origin, direction, center, r):
+    """Returns the distance along the ray (with a unit direction) to the circle,
+    or None if it misses."""
+    qx, qy = origin[0] - center[0], origin[1] - center[1]
+    b = qx * direction[0] + qy * direction[1]
+    c = qx * qx + qy * qy - r * r
+    disc = b * b - c
+    if disc < 0:
+        return None
+    t = -b - math.sqrt(disc)
+    if t < 0:
+        t = -b + math.sqrt(disc)
+    if t < 0:
+        return None
+    return t
@@ -0,0 +1,109 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Provides the clocks that programs use to time their modes."""
+
+import time
+import warnings
+
+import gevent
+
+try:
+    from time import monotonic
+except ImportError:
+    try:
+        # Python 2 needs the `monotonic` package from PyPI.
+        from monotonic import monotonic
+    except ImportError:
+        # Better a clock that can jump than no clock at all, but say so, since
+        # modes will end at the wrong time if the system clock is adjusted.
+        warnings.warn("the monotonic package is not installed, so timing "
+                      "falls back to time.time (pip install monotonic)",
+                      RuntimeWarning)
+        monotonic = time.time
+
+
+# Largest amount by which a duration will be shortened to compensate for the
+# latency in ending modes (seconds).
+MAX_DRIFT = 0.1
+
+
+class Clock(object):
+
+    """A monotonic clock that measures real time. Unlike `time.time`, it is not
+    affected when the system's wall clock is adjusted."""
+
+    def time(self):
+        """Returns the current time in seconds. Only differences between the
+        returned values are meaningful."""
+        return monotonic()
+
+    def sleep(self, seconds):
+        """Sleeps for the given number of seconds, yielding to other
+        greenlets."""
+        gevent.sleep(seconds)
+
+    def wait(self, event, timeout=None):
+        """Waits until the gevent event is set or the timeout (in seconds)
+        expires. Returns true if the event was set."""
+        return event.wait(timeout)
+
+
+class VirtualClock(object):
+
+    """A clock that only moves forward when it is told to. Sleeping and waiting
+    advance it instantly, so code using it can run much faster than real time
+    (and deterministically) in tests and simulations."""
+
+    def __init__(self, start=0.0):
+        """Creates a virtual clock that reads `start` seconds."""
+        self.now = start
+
+    def time(self):
+        """Returns the current virtual time in seconds."""
+        return self.now
+
+    def advance(self, seconds):
+        """Moves the clock forward by the given number of seconds."""
+        self.now += max(0.0, seconds)
+
+    def sleep(self, seconds):
+        """Advances the clock instead of sleeping."""
+        self.advance(seconds)
+
+    def wait(self, event, timeout=None):
+        """Advances the clock by the timeout unless the event is already set.
+        Returns true if the event was set. Never blocks."""
+        if not event.is_set() and timeout is not None:
+            self.advance(timeout)
+        return event.is_set()
+
+
+class DriftCompensator(object):
+
+    """Learns how late timed modes end and shortens later durations to make up
+    for it.
+
+    A mode always ends a little after its planned duration, because the loop
+    has to wake up and notice that the time has passed. That latency is mostly
+    systematic, so it is fed back into an offset (like the integral term of a
+    PID controller) that is subtracted from every planned duration.
+    """
+
+    def __init__(self):
+        """Creates a compensator that has not measured anything yet."""
+        self.offset = 0.0
+        self.overshoot = 0.0
+        self.count = 0
+
+    def adjust(self, duration):
+        """Returns the duration to actually wait for in order to end after the
+        given planned duration."""
+        return max(0.0, duration - self.offset)
+
+    def record(self, planned, actual, gain):
+        """Records that a mode with the given planned duration actually lasted
+        `actual` seconds, and corrects the offset by `gain` times the error."""
+        self.overshoot = actual - planned
+        self.count += 1
+        self.offset += gain * self.overshoot
+        self.offset = min(MAX_DRIFT, max(0.0, self.offset))
@@ -0,0 +1,293 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Searches for the program parameters that work best in simulation."""
+
+import hashlib
+import json
+import math
+import multiprocessing
+import random
+
+from scribbler.controller import DEFAULT_PROGRAM, PROGRAMS
+from scribbler.programs.base import PARAM_PREFIX
+from scribbler.simulation import SimulatedRobot, safe_run
+
+
+# Search methods, by name.
+METHODS = ['grid', 'random', 'es']
+
+# Default weights of the metrics that are added up into a run's cost.
+DEFAULT_WEIGHTS = {
+    'path_error': 1.0
+}
+
+# Cost added for each run in which the program didn't finish in time. Programs
+# that never finish (like the avoider) pay it in every run, so it doesn't
+# change which parameters are best for them.
+INCOMPLETE_PENALTY = 100.0
+
+# Parameter values are rounded to this many significant digits, so that nearly
+# equal candidates share their cached results.
+SIGNIFICANT_DIGITS = 6
+
+# Number of candidates in each generation of the evolution strategy, and the
+# fraction of them that the next generation is bred from.
+POPULATION = 12
+ELITE_FRACTION = 0.25
+
+# How much of the old mean and spread the evolution strategy keeps in each
+# generation (from 0 to 1).
+SMOOTHING = 0.3
+
+
+class Param(object):
+
+    """A parameter to tune, with the range of values to try."""
+
+    def __init__(self, code, name, low, high, integer=False):
+        """Creates a parameter with the given short code and name that takes
+        values from `low` to `high` (rounded if `integer` is true)."""
+        self.code = code
+        self.name = name
+        self.low = float(low)
+        self.high = float(high)
+        self.integer = integer
+
+    def clip(self, value):
+        """Returns the nearest allowed value."""
+        value = max(self.low, min(self.high, value))
+        if self.integer:
+            return int(round(value))
+        return float('{:.{}g}'.format(value, SIGNIFICANT_DIGITS))
+
+    def steps(self, n):
+        """Returns up to `n` evenly spaced values covering the range."""
+        if n <= 1 or self.low == self.high:
+            return [self.clip((self.low + self.high) / 2)]
+        values = [self.clip(self.low + i * (self.high - self.low) / (n - 1))
+                  for i in range(n)]
+        return sorted(set(values))
+
+
+def program_params(program_id):
+    """Returns the short codes and default values of the program's parameters
+    (two dictionaries like `PARAM_CODES` and `PARAM_DEFAULTS`)."""
+    if program_id not in PROGRAMS:
+        raise ValueError("unknown program '{}'".format(program_id))
+    program = SimulatedRobot(None, None, program_id).controller.program
+    return program.codes, program.defaults
+
+
+def param_space(specs, program_ids):
+    """Builds the list of parameters to tune from a dictionary mapping short
+    codes to ranges. A range is a list `[low, high]`, optionally followed by
+    'int' for parameters that only take whole numbers, or None for half to
+    one and a half times the default value. Every code must belong to all of
+    the programs."""
+    tables = [program_params(p) for p in program_ids]
+    space = []
+    for code in sorted(specs):
+        for codes, _ in tables:
+            if code not in codes:
+                raise ValueError("invalid code: " + code)
+        codes, defaults = tables[0]
+        name = codes[code]
+        spec = specs[code]
+        if spec is None:
+            default = defaults[name]
+            spec = sorted([0.5 * default, 1.5 * default])
+            if isinstance(default, int):
+                spec.append('int')
+        integer = len(spec) > 2 and spec[2] == 'int'
+        space.append(Param(code, name, spec[0], spec[1], integer))
+    return space
+
+
+def parse_weights(text):
+    """Parses weights given as 'metric=weight' pairs separated by commas."""
+    weights = {}
+    for pair in text.split(','):
+        metric, _, weight = pair.partition('=')
+        weights[metric.strip()] = float(weight) if weight else 1.0
+    return weights
+
+
+def run_cost(result, weights):
+    """Returns the cost of one run: the weighted sum of its metrics, plus a
+    penalty if it didn't finish. Runs that failed cost infinitely much."""
+    if result.get('error'):
+        return float('inf')
+    cost = 0.0
+    for metric, weight in weights.items():
+        value = result.get(metric)
+        if value is None:
+            return float('inf')
+        cost += weight * value
+    if not result['completed']:
+        cost += INCOMPLETE_PENALTY
+    return cost
+
+
+def cache_key(scenario, values):
+    """Returns the key of the run of the scenario with the given parameter
+    values (a dictionary from short codes to values)."""
+    data = json.dumps([scenario, values], sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class Tuner(object):
+
+    """Evaluates parameter values by running scenarios with them.
+
+    The cost of a set of values is the mean cost of running every scenario
+    with them. Runs are spread over a pool of worker processes, and each run's
+    result is cached by the scenario and the values, so nothing is ever
+    simulated twice. The cache can be kept in a file of JSON lines, which lets
+    a later search (even with a different objective) reuse the runs of an
+    earlier one.
+    """
+
+    def __init__(self, scenarios, space, weights=DEFAULT_WEIGHTS,
+                 processes=None, cache_path=None):
+        """Creates a tuner for the parameters in `space` (see `param_space`)
+        that runs the scenarios on the given number of processes (one per CPU
+        by default). The cost of a run is computed with `weights`."""
+        self.scenarios = scenarios
+        self.space = space
+        self.weights = weights
+        self.pool = multiprocessing.Pool(processes)
+        self.cache = {}
+        self.cache_file = None
+        self.history = []
+        if cache_path:
+            try:
+                with open(cache_path) as f:
+                    for line in f:
+                        key, result = json.loads(line)
+                        self.cache[key] = result
+            except IOError:
+                pass
+            self.cache_file = open(cache_path, 'a')
+
+    def close(self):
+        """Stops the worker processes and closes the cache file."""
+        self.pool.terminate()
+        if self.cache_file:
+            self.cache_file.close()
+
+    def with_values(self, scenario, values):
+        """Returns a copy of the scenario that sets the parameters to the
+        given values before the program starts."""
+        commands = ["{}{}={}".format(PARAM_PREFIX, code, values[code])
+                    for code in sorted(values)]
+        copy = dict(scenario)
+        # The candidate's values come last, so that they override any values
+        # the scenario sets for the simulated robot.
+        copy['commands'] = list(scenario.get('commands', [])) + commands
+        return copy
+
+    def evaluate(self, candidates):
+        """Returns the cost of each candidate (a dictionary from short codes
+        to values). The runs that aren't cached are all done in parallel."""
+        keys = [[cache_key(s, c) for s in self.scenarios] for c in candidates]
+        jobs = {}
+        for c, row in zip(candidates, keys):
+            for s, key in zip(self.scenarios, row):
+                if key not in self.cache and key not in jobs:
+                    jobs[key] = self.with_values(s, c)
+        order = list(jobs)
+        results = self.pool.map(safe_run, [jobs[k] for k in order])
+        for key, result in zip(order, results):
+            self.cache[key] = result
+            if self.cache_file:
+                self.cache_file.write(json.dumps([key, result]) + '\n')
+        if self.cache_file:
+            self.cache_file.flush()
+        costs = []
+        for c, row in zip(candidates, keys):
+            runs = [run_cost(self.cache[key], self.weights) for key in row]
+            cost = sum(runs) / len(runs)
+            self.history.append((cost, c))
+            costs.append(cost)
+        return costs
+
+    def best(self):
+        """Returns the pair `(cost, values)` of the best candidate so far."""
+        return min(self.history, key=lambda h: h[0])
+
+    def grid(self, steps):
+        """Tries every combination of `steps` evenly spaced values of each
+        parameter."""
+        candidates = [{}]
+        for param in self.space:
+            candidates = [dict(c, **{param.code: v})
+                          for c in candidates for v in param.steps(steps)]
+        self.evaluate(candidates)
+        return self.best()
+
+    def random(self, n, seed=0):
+        """Tries `n` candidates drawn uniformly from the ranges."""
+        rand = random.Random(seed)
+        candidates = [dict((p.code, p.clip(rand.uniform(p.low, p.high)))
+                           for p in self.space) for _ in range(n)]
+        self.evaluate(candidates)
+        return self.best()
+
+    def es(self, n, seed=0):
+        """Tries about `n` candidates with an evolution strategy. Each
+        generation is drawn from a normal distribution for every parameter,
+        and the next one is centred on the best candidates of this one, with
+        a spread that shrinks as they agree (like a CMA-ES without the
+        correlations between parameters)."""
+        rand = random.Random(seed)
+        mean = [(p.low + p.high) / 2 for p in self.space]
+        spread = [(p.high - p.low) / 4 for p in self.space]
+        elites = max(1, int(POPULATION * ELITE_FRACTION))
+        for _ in range(max(1, n // POPULATION)):
+            candidates = [dict((p.code, p.clip(rand.gauss(m, s)))
+                               for p, m, s in zip(self.space, mean, spread))
+                          for _ in range(POPULATION)]
+            costs = self.evaluate(candidates)
+            ranked = sorted(zip(costs, range(POPULATION)))[:elites]
+            best = [candidates[i] for _, i in ranked]
+            for j, p in enumerate(self.space):
+                values = [b[p.code] for b in best]
+                m = sum(values) / float(len(values))
+                s = math.sqrt(sum((v - m) ** 2 for v in values) / len(values))
+                mean[j] = SMOOTHING * mean[j] + (1 - SMOOTHING) * m
+                spread[j] = SMOOTHING * spread[j] + (1 - SMOOTHING) * s
+        return self.best()
+
+    def search(self, method, n, seed=0):
+        """Searches with the method named `method` (one of `METHODS`), using
+        a budget of about `n` candidates (for the grid, `n` values of each
+        parameter). Returns the pair `(cost, values)` of the best one."""
+        if method == 'grid':
+            return self.grid(n)
+        if method == 'random':
+            return self.random(n, seed)
+        if method == 'es':
+            return self.es(n, seed)
+        raise ValueError("unknown search method '{}'".format(method))
+
+
+def scenario_programs(scenarios):
+    """Returns the sorted list of the programs that the scenarios run."""
+    return sorted(set(s.get('program', DEFAULT_PROGRAM) for s in scenarios))
+
+
+def program_scenarios(scenarios, program_id=None):
+    """Returns the scenarios that run the given program, or all of them if the
+    program is None. Raises ValueError unless they all run the same program:
+    the errors of different programs have different scales, so tuning them
+    together would mostly serve the one with the largest errors."""
+    if program_id is not None:
+        scenarios = [s for s in scenarios
+                     if s.get('program', DEFAULT_PROGRAM) == program_id]
+        if not scenarios:
+            raise ValueError("no scenarios run '{}'".format(program_id))
+    programs = scenario_programs(scenarios)
+    if len(programs) > 1:
+        raise ValueError("the scenarios run {}; choose one with -P".format(
+            ", ".join(programs)))
+    return scenarios
@@ -10,6 +10,15 @@ def average(xs):
     return sum(xs) / float(len(xs))
 
 
+def median(xs):
+    """Returns the median of a list of numbers."""
+    s = sorted(xs)
+    n = len(s)
+    if n % 2 == 1:
+        return s[n // 2]
+    return (s[n // 2 - 1] + s[n // 2]) / 2.0
+
+
 def rad_to_deg(theta):
     """Converts radians to degrees."""
     return 180.0 * theta / math.pi
@@ -28,8 +37,10 @@ def dist_2d(x1, y1, x2, y2):
 def equiv_angle(theta):
     """Returns the smallest angle (positive or negative) that is equivalent to
     `theta`. For example, 3/2*PI will be converted to -1/2*PI."""
-    while theta > math.pi:
-        theta -= 2 * math.pi
-    while theta < -math.pi:
-        theta += 2 * math.pi
+    # Subtract the whole number of turns at once instead of one at a time.
+    turn = 2 * math.pi
+    if theta > math.pi:
+        return theta - turn * math.ceil((theta - math.pi) / turn)
+    if theta < -math.pi:
+        return theta + turn * math.ceil((-math.pi - theta) / turn)
     return theta
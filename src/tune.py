@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+from scribbler.simulation import load_scenarios, repeat
+from scribbler.tuning import METHODS, Tuner, param_space, parse_weights
+from scribbler.tuning import program_scenarios, scenario_programs
+
+
+# Description for the usage message.
+DESC = "Tunes program parameters by running scenarios in simulation."
+
+# Configure the arguments.
+parser = argparse.ArgumentParser(description=DESC)
+parser.add_argument(
+    'scenarios',
+    type=str,
+    help="JSON file containing a list of scenarios"
+)
+parser.add_argument(
+    '-p',
+    '--param',
+    type=str,
+    action='append',
+    required=True,
+    help="tune the parameter with this code, as CODE or CODE=LOW:HIGH[:int]"
+)
+parser.add_argument(
+    '-P',
+    '--program',
+    type=str,
+    help="only run the scenarios for this program (required if they run more "
+         "than one)"
+)
+parser.add_argument(
+    '-m',
+    '--method',
+    choices=METHODS,
+    default='es',
+    help="search method (default: es)"
+)
+parser.add_argument(
+    '-n',
+    '--budget',
+    type=int,
+    default=60,
+    help="number of candidates to try (values per parameter for the grid)"
+)
+parser.add_argument(
+    '-w',
+    '--weights',
+    type=str,
+    default='path_error=1',
+    help="cost of a run, as METRIC=WEIGHT pairs separated by commas"
+)
+parser.add_argument(
+    '-r',
+    '--repeat',
+    type=int,
+    default=1,
+    help="run each scenario this many times with different noise seeds"
+)
+parser.add_argument(
+    '-j',
+    '--jobs',
+    type=int,
+    default=None,
+    help="number of worker processes (one per CPU by default)"
+)
+parser.add_argument(
+    '-c',
+    '--cache',
+    type=str,
+    help="reuse and record the results of runs in this file"
+)
+parser.add_argument(
+    '--seed',
+    type=int,
+    default=0,
+    help="seed for the random search methods"
+)
+
+# Parse the arguments.
+args = parser.parse_args()
+specs = {}
+for spec in args.param:
+    code, _, bounds = spec.partition('=')
+    if bounds:
+        parts = bounds.split(':')
+        specs[code] = [float(parts[0]), float(parts[1])] + parts[2:]
+    else:
+        specs[code] = None
+try:
+    scenarios = program_scenarios(load_scenarios(args.scenarios), args.program)
+    scenarios = repeat(scenarios, args.repeat)
+    space = param_space(specs, scenario_programs(scenarios))
+except ValueError as e:
+    print("error: " + str(e), file=sys.stderr)
+    sys.exit(1)
+
+# Search, then show the best values as commands for the console.
+tuner = Tuner(scenarios, space, parse_weights(args.weights), args.jobs,
+              args.cache)
+try:
+    cost, values = tuner.search(args.method, args.budget, args.seed)
+finally:
+    tuner.close()
+print("tried {} candidates, best cost {:.4f}".format(len(tuner.history), cost),
+      file=sys.stderr)
+for param in space:
+    print("set:{}={}".format(param.code, values[param.code]))